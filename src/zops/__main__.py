@@ -18,6 +18,7 @@ def aws():
 aws.add_command(aws_commands.ami_build)
 aws.add_command(aws_commands.ami_deregister)
 aws.add_command(aws_commands.ami_list)
+aws.add_command(aws_commands.ami_prune)
 aws.add_command(aws_commands.asg_instance_refresh, "asg.instance-refresh")
 aws.add_command(aws_commands.asg_list)
 aws.add_command(aws_commands.asg_update)
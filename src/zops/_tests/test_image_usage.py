@@ -0,0 +1,165 @@
+from zops.aws.image_usage import ImageUsageIndex
+
+
+class _Client:
+    """
+    Minimal boto3 client stub: each paginator returns a single page computed from the
+    paginate() arguments.
+    """
+
+    def __init__(self, **pages):
+        self._pages = pages
+        self.calls = []
+
+    def get_paginator(self, operation):
+        client = self
+
+        class _Paginator:
+            def paginate(self, **kwargs):
+                client.calls.append((operation, kwargs))
+                return [client._pages[operation](**kwargs)]
+
+        return _Paginator()
+
+
+LAUNCH_TEMPLATE_VERSIONS = {
+    ("lt-1", 1): "ami-lt1-v1",
+    ("lt-1", 2): "ami-lt1-v2",
+    ("lt-1", 3): "ami-lt1-v3",
+    ("lt-2", 1): "ami-lt2-v1",
+}
+
+
+def _describe_launch_template_versions(Versions, LaunchTemplateId=None):
+    result = []
+    for (i_lt_id, i_version), i_image_id in LAUNCH_TEMPLATE_VERSIONS.items():
+        latest = max(j for i, j in LAUNCH_TEMPLATE_VERSIONS if i == i_lt_id)
+        default = i_version == 1
+        if LaunchTemplateId is None:
+            selected = (i_version == latest and "$Latest" in Versions) or (
+                default and "$Default" in Versions
+            )
+        else:
+            selected = i_lt_id == LaunchTemplateId and str(i_version) in Versions
+        if selected:
+            result.append(
+                dict(
+                    LaunchTemplateId=i_lt_id,
+                    LaunchTemplateName=i_lt_id.replace("lt-", "template-"),
+                    VersionNumber=i_version,
+                    DefaultVersion=default,
+                    LaunchTemplateData={"ImageId": i_image_id},
+                )
+            )
+    return {"LaunchTemplateVersions": result}
+
+
+def _build():
+    ec2_client = _Client(
+        describe_launch_template_versions=_describe_launch_template_versions,
+        describe_instances=lambda Filters: {
+            "Reservations": [
+                {
+                    "Instances": [
+                        {"InstanceId": "i-1", "ImageId": "ami-lt1-v3"},
+                        {"InstanceId": "i-2", "ImageId": "ami-orphan"},
+                    ]
+                }
+            ]
+        },
+    )
+    autoscaling_client = _Client(
+        describe_launch_configurations=lambda: {
+            "LaunchConfigurations": [
+                {"LaunchConfigurationName": "lc-1", "ImageId": "ami-lc1"},
+            ]
+        },
+        describe_auto_scaling_groups=lambda: {
+            "AutoScalingGroups": [
+                {
+                    "AutoScalingGroupName": "asg-latest",
+                    "LaunchTemplate": {
+                        "LaunchTemplateId": "lt-1",
+                        "Version": "$Latest",
+                    },
+                },
+                {
+                    "AutoScalingGroupName": "asg-pinned",
+                    "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "2"},
+                },
+                {
+                    "AutoScalingGroupName": "asg-mixed",
+                    "MixedInstancesPolicy": {
+                        "LaunchTemplate": {
+                            "LaunchTemplateSpecification": {"LaunchTemplateId": "lt-2"}
+                        }
+                    },
+                },
+                {
+                    "AutoScalingGroupName": "asg-lc",
+                    "LaunchConfigurationName": "lc-1",
+                },
+            ]
+        },
+    )
+    return ImageUsageIndex.build(ec2_client, autoscaling_client, "ca-central-1")
+
+
+def test_image_usage_index_asg_images():
+    index = _build()
+
+    assert index.asg_image_id("asg-latest") == "ami-lt1-v3"
+    assert index.asg_image_id("asg-pinned") == "ami-lt1-v2"
+    assert index.asg_image_id("asg-mixed") == "ami-lt2-v1"
+    assert index.asg_image_id("asg-lc") == "ami-lc1"
+    assert index.asg_image_id("unknown") is None
+
+
+def test_image_usage_index_used_by():
+    index = _build()
+
+    assert index.image_ids() == {
+        "ami-lt1-v1",
+        "ami-lt1-v2",
+        "ami-lt1-v3",
+        "ami-lt2-v1",
+        "ami-lc1",
+        "ami-orphan",
+    }
+    assert "ami-unused" not in index
+    assert index.used_by("ami-unused") is None
+    assert str(index.used_by("ami-lt1-v3")) == (
+        "asg:asg-latest, lt:template-1:3, 1 instance(s)"
+    )
+    assert str(index.used_by("ami-lt1-v2")) == "asg:asg-pinned, lt:template-1:2"
+    assert str(index.used_by("ami-lt1-v1")) == "lt:template-1:1"
+    assert str(index.used_by("ami-lc1")) == "asg:asg-lc, lc:lc-1"
+    assert str(index.used_by("ami-orphan")) == "1 instance(s)"
+
+
+def test_image_usage_index_fetches_only_referenced_versions():
+    ec2_client = _Client(
+        describe_launch_template_versions=_describe_launch_template_versions,
+        describe_instances=lambda Filters: {"Reservations": []},
+    )
+    autoscaling_client = _Client(
+        describe_launch_configurations=lambda: {"LaunchConfigurations": []},
+        describe_auto_scaling_groups=lambda: {
+            "AutoScalingGroups": [
+                {
+                    "AutoScalingGroupName": "asg-pinned",
+                    "LaunchTemplate": {"LaunchTemplateId": "lt-1", "Version": "2"},
+                },
+            ]
+        },
+    )
+
+    ImageUsageIndex.build(ec2_client, autoscaling_client, "ca-central-1")
+
+    assert [i for i in ec2_client.calls if i[0] != "describe_instances"] == [
+        ("describe_launch_template_versions", {"Versions": ["$Latest", "$Default"]}),
+        (
+            "describe_launch_template_versions",
+            {"LaunchTemplateId": "lt-1", "Versions": ["2"]},
+        ),
+    ]
@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+
+from zops.aws.image import Image
+from zops.aws.retention import RetentionPolicy
+
+
+NOW = datetime.datetime(2025, 3, 10, 12, 0)
+
+
+def _image(image_id, days_ago, tag_name="app", owner_id="111", name=None):
+    return Image(
+        image_id=image_id,
+        name=name or f"{tag_name}-{image_id}",
+        tag_name=tag_name,
+        owner_id=owner_id,
+        region="ca-central-1",
+        creation_date=(NOW - datetime.timedelta(days=days_ago)).strftime(
+            "%Y-%m-%d %H:%M"
+        ),
+    )
+
+
+def _evaluate(policy, images, in_use=frozenset()):
+    return {
+        i.image_id: reason
+        for i, reason in policy.evaluate(images, 111, in_use=in_use, now=NOW)
+    }
+
+
+def test_retention_policy_requires_a_rule():
+    with pytest.raises(ValueError):
+        RetentionPolicy()
+
+
+def test_retention_policy_keep_latest():
+    images = [_image(f"ami-{i}", days_ago=i) for i in range(4)]
+    images.append(_image("ami-cron", days_ago=10, tag_name="cron"))
+
+    assert _evaluate(RetentionPolicy(keep_latest=2), images) == {
+        "ami-0": "latest #1",
+        "ami-1": "latest #2",
+        "ami-2": None,
+        "ami-3": None,
+        "ami-cron": "latest #1",
+    }
+
+
+def test_retention_policy_max_age():
+    images = [
+        _image("ami-new", days_ago=5),
+        _image("ami-old", days_ago=40),
+        _image("ami-unknown", days_ago=40),
+    ]
+    images[-1].creation_date = None
+
+    assert _evaluate(RetentionPolicy(max_age=30), images) == {
+        "ami-new": "recent",
+        "ami-old": None,
+        "ami-unknown": "recent",
+    }
+
+
+def test_retention_policy_keeps_shared_and_in_use():
+    images = [
+        _image("ami-0", days_ago=1),
+        _image("ami-shared", days_ago=50, owner_id="222"),
+        _image("ami-used", days_ago=60),
+        _image("ami-old", days_ago=70),
+    ]
+
+    assert _evaluate(
+        RetentionPolicy(keep_latest=1, max_age=30), images, in_use={"ami-used"}
+    ) == {
+        "ami-0": "latest #1",
+        "ami-shared": "shared",
+        "ami-used": "in use",
+        "ami-old": None,
+    }
+
+
+def test_retention_policy_groups_untagged_images_by_name():
+    images = [
+        _image("ami-0", days_ago=40, tag_name="-", name="base-1"),
+        _image("ami-1", days_ago=50, tag_name="-", name="base-2"),
+    ]
+
+    assert _evaluate(RetentionPolicy(keep_latest=1), images) == {
+        "ami-0": "latest #1",
+        "ami-1": "latest #1",
+    }
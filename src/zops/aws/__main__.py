@@ -1,9 +1,9 @@
+import concurrent.futures
 import itertools
 import operator
 import os
 import re
 import sys
-import time
 from operator import attrgetter
 from operator import itemgetter
 from pathlib import Path
@@ -14,11 +14,14 @@ import click
 from tabulate import tabulate
 
 from zops.aws.autoscaling import AutoScalingGroup
+from zops.aws.autoscaling import InstanceRefreshMonitor
 from zops.aws.cli_config import load_config
 from zops.aws.cluster import Cluster
 from zops.aws.ecs import EcsCluster
 from zops.aws.image import Image
 from zops.aws.instance import Instance
+from zops.aws.retention import RetentionPolicy
+from zops.aws.ssm import FleetCommand
 from zops.aws.utils_click import STRING_LIST
 
 
@@ -45,7 +48,12 @@ from zops.aws.utils_click import STRING_LIST
     ),
     help="Sort list by thie attribute. Default: creation_date",
 )
-def ami_list(clusters, regions, force_regions, sort_by):
+@click.option(
+    "--used-by",
+    is_flag=True,
+    help="Show the ASGs, launch templates and instances using each image.",
+)
+def ami_list(clusters, regions, force_regions, sort_by, used_by):
     """
     List AMIs in a cluster.
 
@@ -60,18 +68,29 @@ def ami_list(clusters, regions, force_regions, sort_by):
     \b
       # List AMI images. Try to guess the cluster based on the current directory.
       $ uh aws ami.list
+
+    \b
+      # List AMI images for tier3's cluster and where they are used.
+      $ uh aws ami.list tier3 --used-by
     """
     load_config()
     clusters = Cluster.clusters_arg(clusters)
 
     rows = [[i[1] for i in Image._iter_attrs()]]
+    if used_by:
+        rows[0].append("used_by")
     for i_cluster in clusters:
         cluster = Cluster.clusters[i_cluster]
         regions = cluster.regions_arg(regions, force=force_regions)
+        image_usage_indexes = cluster.image_usage_indexes(regions) if used_by else {}
         for i_ami in sorted(
             cluster.list_images(regions=regions), key=attrgetter(sort_by)
         ):
-            rows.append([getattr(i_ami, j_name) for j_name, _ in Image._iter_attrs()])
+            row = [getattr(i_ami, j_name) for j_name, _ in Image._iter_attrs()]
+            if used_by:
+                usage = image_usage_indexes[i_ami.region].used_by(i_ami.image_id)
+                row.append(str(usage or ""))
+            rows.append(row)
 
     print(tabulate(rows, headers="firstrow"))
 
@@ -129,30 +148,181 @@ role_arn={role_arn}
 @click.argument("cluster")
 @click.argument("image_names", nargs=-1)
 @click.option("--regions", type=STRING_LIST, default="*")
+@click.option("--force-regions", is_flag=True)
+@click.option(
+    "--keep-snapshots",
+    is_flag=True,
+    help="Do not delete the EBS snapshots associated with the images.",
+)
+@click.option("--jobs", type=int, default=8, help="Number of concurrent API calls.")
 @click.option("--yes", is_flag=True)
-def ami_deregister(cluster, image_names, regions, yes):
+def ami_deregister(
+    cluster, image_names, regions, force_regions, keep_snapshots, jobs, yes
+):
     """
     Deregister AMIs with the given version.
+
+    IMAGE_NAMES: Regular expressions matched against the image names.
+
+    Examples:
+
+    \b
+      # Show what would be deregistered for version 2.0.10 on all regions.
+      $ uh aws ami.deregister unhaggle-ami ".*-2.0.10$"
+
+    \b
+      # Deregister (and delete snapshots) of version 2.0.10 images.
+      $ uh aws ami.deregister unhaggle-ami ".*-2.0.10$" --yes
     """
     load_config()
     internal_cluster = Cluster.clusters[cluster]
-    regions = ("ca-central-1", "us-east-2")
+    regions = internal_cluster.regions_arg(regions, force=force_regions)
 
-    def _items():
-        """
-        List items (image) to be deregistered.
-        """
-        result = []
-        for i_image in internal_cluster.list_images(regions=regions):
-            for j_image_name in image_names:
-                m = re.match(j_image_name, i_image.name)
-                if m is not None:
-                    result.append(i_image)
-        return result
+    if not image_names:
+        raise click.ClickException("No image names given.")
+    image_name_regex = re.compile("|".join(f"(?:{i})" for i in image_names))
 
-    for i_image in _items():
-        i_image.msg("DEREGISTER")
-        i_image.deregister(yes=yes)
+    images = [
+        i
+        for i in internal_cluster.list_images(regions=regions)
+        if i.name is not None and image_name_regex.match(i.name)
+    ]
+
+    failures = internal_cluster.deregister_images(
+        images, delete_snapshots=not keep_snapshots, jobs=jobs, yes=yes
+    )
+
+    _print_deregister_summary(images, failures, keep_snapshots, yes)
+
+
+def _print_deregister_summary(images, failures, keep_snapshots, yes):
+    """
+    Prints the number of images deregistered and storage reclaimed (or to be reclaimed on dry-run).
+    """
+    failed_images = {id(i) for i, _e in failures}
+    images = [i for i in images if id(i) not in failed_images]
+    snapshots_count = 0 if keep_snapshots else sum(len(i.snapshots) for i in images)
+    snapshots_size = 0 if keep_snapshots else sum(i.snapshots_size for i in images)
+    if yes:
+        summary = "Deregistered {} image(s) and deleted {} snapshot(s), reclaiming up to {} GiB."
+    else:
+        summary = "Would deregister {} image(s) and delete {} snapshot(s), reclaiming up to {} GiB."
+    print("\n" + summary.format(len(images), snapshots_count, snapshots_size))
+    if failures:
+        raise click.ClickException(f"Failed to deregister {len(failures)} image(s).")
+
+
+@click.command("ami.prune")
+@click.argument("clusters", nargs=-1, required=True)
+@click.option("--regions", type=STRING_LIST, default="*")
+@click.option("--force-regions", is_flag=True)
+@click.option(
+    "--keep-latest",
+    type=int,
+    default=None,
+    help="Keep the N latest images of each tag_name (per region).",
+)
+@click.option(
+    "--max-age",
+    type=int,
+    default=None,
+    help="Keep images younger than this number of days.",
+)
+@click.option(
+    "--keep-snapshots",
+    is_flag=True,
+    help="Do not delete the EBS snapshots associated with the images.",
+)
+@click.option("--jobs", type=int, default=8, help="Number of concurrent API calls.")
+@click.option("--yes", is_flag=True)
+def ami_prune(
+    clusters, regions, force_regions, keep_latest, max_age, keep_snapshots, jobs, yes
+):
+    """
+    Deregister old AMIs based on retention rules.
+
+    Images referenced by instances, launch templates or launch configurations in any of the given
+    CLUSTERS are always kept, so list the clusters consuming shared images along with the cluster
+    that owns them. Only images owned by each cluster account are deregistered.
+
+    Examples:
+
+    \b
+      # Keep the 3 latest images of each kind and anything newer than 30 days.
+      $ uh aws ami.prune unhaggle-ami tier3 tier1 --keep-latest=3 --max-age=30
+    """
+    load_config()
+    try:
+        policy = RetentionPolicy(keep_latest=keep_latest, max_age=max_age)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    clusters = [Cluster.get_cluster(i) for i in clusters]
+    clusters_regions = {
+        i.name: i.regions_arg(regions, force=force_regions) for i in clusters
+    }
+
+    def _scan(cluster):
+        cluster_regions = clusters_regions[cluster.name]
+        return (
+            cluster.list_images(regions=cluster_regions),
+            cluster.image_usage_indexes(regions=cluster_regions),
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(len(clusters)) as executor:
+        scans = list(executor.map(_scan, clusters))
+    image_usage_indexes = [j for _images, i in scans for j in i.values()]
+    in_use = frozenset().union(*[i.image_ids() for i in image_usage_indexes])
+
+    def _used_by(image_id):
+        return ", ".join(
+            str(i.used_by(image_id)) for i in image_usage_indexes if image_id in i
+        )
+
+    rows = [["cluster", "image_id", "name", "region", "creation_date", "action"]]
+    deletions = {}
+    seen = set()
+    for i_cluster, (i_images, _in_use) in zip(clusters, scans):
+        for j_image, j_reason in policy.evaluate(i_images, i_cluster.aws_id, in_use):
+            # Skip images from other accounts and clusters sharing the same account.
+            if j_reason == "shared" or (j_image.region, j_image.image_id) in seen:
+                continue
+            seen.add((j_image.region, j_image.image_id))
+            if j_reason is None:
+                deletions.setdefault(i_cluster.name, (i_cluster, []))[1].append(j_image)
+            if j_reason is None:
+                action = "DELETE"
+            elif j_reason == "in use":
+                action = f"keep (in use: {_used_by(j_image.image_id)})"
+            else:
+                action = f"keep ({j_reason})"
+            rows.append(
+                [
+                    i_cluster.name,
+                    j_image.image_id,
+                    j_image.name,
+                    j_image.region,
+                    j_image.creation_date,
+                    action,
+                ]
+            )
+    print(tabulate(rows, headers="firstrow"))
+
+    with concurrent.futures.ThreadPoolExecutor(len(deletions) or 1) as executor:
+        futures = [
+            executor.submit(
+                i_cluster.deregister_images,
+                i_images,
+                delete_snapshots=not keep_snapshots,
+                jobs=jobs,
+                yes=yes,
+            )
+            for i_cluster, i_images in deletions.values()
+        ]
+        failures = [j for i in futures for j in i.result()]
+
+    images = [j for _cluster, i_images in deletions.values() for j in i_images]
+    _print_deregister_summary(images, failures, keep_snapshots, yes)
 
 
 @click.command("ami.build")
@@ -347,8 +517,9 @@ def deployments_list(clusters, revision_width):
 @click.argument("clusters", nargs=-1)
 @click.option("--sort-by", default="launch_time")
 @click.option("--volumes", is_flag=True)
+@click.option("--health", is_flag=True, help="Show the health in ELBv2 target groups.")
 @click.option("--keys", type=list, default=Instance._ATTRS)
-def ec2_list(sort_by, volumes, keys, clusters):
+def ec2_list(sort_by, volumes, health, keys, clusters):
     """
     List AWS EC2 instances.
     """
@@ -357,6 +528,8 @@ def ec2_list(sort_by, volumes, keys, clusters):
 
     if volumes:
         keys += ["encrypted_volumes"]
+    if health:
+        keys += ["elb.health"]
 
     rows = [keys]
     for i_cluster in clusters:
@@ -396,18 +569,93 @@ def ec2_start(instance_names):
 @click.option("--profile", type=str, default=None)
 @click.option("--region", default=None)
 @click.option("--command", type=str, default=None)
-@click.option("--sleep", type=int, default=1)
-def ec2_shell(instance_seed, index, profile, region, command, sleep):
+@click.option(
+    "--sleep",
+    type=int,
+    default=1,
+    help="Initial interval (seconds) between command status checks.",
+)
+@click.option(
+    "--fleet",
+    is_flag=True,
+    help="Run --command on all instances matching INSTANCE_SEED.",
+)
+@click.option("--asg", default=None, help="Run --command on all instances of the ASG.")
+@click.option(
+    "--tag",
+    "tags",
+    multiple=True,
+    help="Run --command on all instances with the tag (KEY=VALUE).",
+)
+@click.option(
+    "--max-concurrency",
+    default="50",
+    help="Number (or percentage) of instances running the command at once.",
+)
+@click.option(
+    "--max-errors",
+    default="0",
+    help="Number (or percentage) of errors before stopping the command.",
+)
+@click.option(
+    "--timeout",
+    type=int,
+    default=600,
+    help="Maximum execution time (seconds) of the command on each instance.",
+)
+def ec2_shell(
+    instance_seed,
+    index,
+    profile,
+    region,
+    command,
+    sleep,
+    fleet,
+    asg,
+    tags,
+    max_concurrency,
+    max_errors,
+    timeout,
+):
     """
     Start SSM session on AWS EC2 instance.
+
+    With --command, runs the command using SSM Run Command instead. Use --fleet, --asg or --tag
+    to run the command on many instances, printing each instance output as it finishes.
+
+    Examples:
+
+    \b
+      # Start a shell on the first tier3 prod app instance.
+      $ uh aws ec2.shell tier3-prod-app
+
+    \b
+      # Check disk usage on all tier3 prod app instances.
+      $ uh aws ec2.shell tier3-prod-app --fleet --command="df -h"
+
+    \b
+      # Same, but for the instances of an ASG, 25% of the instances at a time.
+      $ uh aws ec2.shell tier3-prod-app --asg=tier3-prod-app --max-concurrency=25% --command="df -h"
     """
     import os
 
     load_config()
     cluster, instance_name = Cluster.instances_arg(instance_seed)
 
+    targets = []
+    if asg:
+        targets.append({"Key": "tag:aws:autoscaling:groupName", "Values": [asg]})
+    for i_tag in tags:
+        tag_key, tag_value = i_tag.split("=", 1)
+        targets.append({"Key": f"tag:{tag_key}", "Values": [tag_value]})
+
+    if targets and not command:
+        raise click.ClickException("Options --asg and --tag require --command.")
+
+    instance_ids = []
     if cluster is None:
-        instance_id = instance_name
+        if not targets:
+            instance_ids = [instance_name]
     else:
         print(f"Instance name: {instance_name}")
         profile = profile or cluster.profile
@@ -417,39 +665,54 @@ def ec2_shell(instance_seed, index, profile, region, command, sleep):
         else:
             region = cluster.regions[0]
         print(f"AWS region: {region}")
-        instances = cluster.get_instance_by_name(instance_name, state="running")
-        if not instances:
-            print(
-                f"""
+        if not targets:
+            instances = cluster.get_instance_by_name(instance_name, state="running")
+            if not instances:
+                print(
+                    f"""
 ERROR: No instances found.
 
 Check if your AWS credentials work with:
   aws --profile={profile} ec2 describe-instances
 """
-            )
-            exit(9)
-        instance = instances[index]
-        instance_id = instance.id
-    print(f"Instance id: {instance_id}")
+                )
+                exit(9)
+            if fleet:
+                instance_ids = [i.id for i in instances]
+            else:
+                instance_ids = [instances[index].id]
+    for i_instance_id in instance_ids:
+        print(f"Instance id: {i_instance_id}")
 
     if command:
-        ssm_client = boto3.Session(profile_name=profile).client("ssm")
-        response = ssm_client.send_command(
-            InstanceIds=[instance_id],
-            DocumentName="AWS-RunShellScript",
-            Parameters={"commands": [command]},
+        ssm_client = boto3.Session(profile_name=profile, region_name=region).client(
+            "ssm"
         )
-        command_id = response["Command"]["CommandId"]
-        for i_retries in range(3):
-            time.sleep(sleep)
-            output = ssm_client.get_command_invocation(
-                CommandId=command_id,
-                InstanceId=instance_id,
-            )
-            if output["Status"] != "InProgress":
-                break
-        print(output["StandardOutputContent"])
+        fleet_command = FleetCommand(
+            ssm_client,
+            command,
+            instance_ids=instance_ids,
+            targets=targets,
+            max_concurrency=max_concurrency,
+            max_errors=max_errors,
+            timeout=timeout,
+        )
+        fleet_command.send()
+        failures = 0
+        try:
+            for i_result in fleet_command.iter_results(poll_interval=sleep):
+                if len(instance_ids) != 1 or targets:
+                    print(f"\n# {i_result['InstanceId']}: {i_result['Status']}")
+                print(i_result["StandardOutputContent"], end="")
+                if i_result["Status"] != "Success":
+                    failures += 1
+                    print(i_result["StandardErrorContent"], end="", file=sys.stderr)
+        except TimeoutError as e:
+            raise click.ClickException(str(e))
+        if failures:
+            raise click.ClickException(f"Command failed on {failures} instance(s).")
     else:
+        instance_id = instance_ids[0]
         cmd = f"aws --profile={profile} ssm start-session --target {instance_id} --document-name AWS-StartInteractiveCommand --parameters command=\"bash -l\""
         print(f"Command line: {cmd}")
         os.system(cmd)  # nosec B605
@@ -477,46 +740,129 @@ def asg_list(asg_seed, profile, region):
 
 @click.command()
 @click.argument("asg_seed")
-def asg_instance_refresh(asg_seed):
+@click.option("--profile", type=str, default=None)
+@click.option("--regions", type=STRING_LIST, default=None)
+@click.option(
+    "--monitor",
+    is_flag=True,
+    help="Wait for the instance refreshes to finish, showing their progress.",
+)
+@click.option(
+    "--monitor-only",
+    is_flag=True,
+    help="Do not start instance refreshes, only monitor the ones in progress.",
+)
+@click.option("--interval", type=int, default=15)
+@click.option("--timeout", type=int, default=3600)
+def asg_instance_refresh(
+    asg_seed, profile, regions, monitor, monitor_only, interval, timeout
+):
     """
     Executes instance-refresh for ASGs
 
     Examples:
         # Update instances related with Tier3's production ASGs.
         uh aws asg.instance-refresh tier3-prod-app
-    """
-    from zops.aws.cluster import list_autoscaling_groups
 
+        # Same, waiting for the instance refreshes to finish.
+        uh aws asg.instance-refresh tier3-prod-app --monitor
+
+        # Monitor instance refreshes in progress for Tier3's ASGs on two regions.
+        uh aws asg.instance-refresh tier3 --monitor-only --regions=ca-central-1,us-east-2
+    """
     load_config()
-    autoscaling_groups = list_autoscaling_groups(asg_seed)
+    monitor_ = InstanceRefreshMonitor()
+    for i_region in regions or [None]:
+        for j_asg in AutoScalingGroup.list_groups(
+            asg_seed, profile_name=profile, region=i_region
+        ):
+            if monitor_only:
+                if not monitor_.track_in_progress(j_asg):
+                    print(f"\n{j_asg.name} >> NOTICE: No instance refresh in progress.")
+                continue
+            monitor_.track(j_asg, j_asg.start_instance_refresh())
+            print(f"\n{j_asg.name} >> SUCCESS: Instance refresh started.")
 
-    for i_asg in autoscaling_groups:
-        asg_name = i_asg["AutoScalingGroupName"]
-        i_asg.start_instance_refresh()
-        print(f"\n{asg_name} >> SUCCESS: Instance refresh started.")
+    if not (monitor or monitor_only):
+        return
+
+    print()
+    failures = monitor_.run(interval=interval, timeout=timeout)
+    if failures:
+        raise click.ClickException(
+            f"Instance refresh failed for: {', '.join(failures)}"
+        )
 
 
 @click.command(name="asg.update")
 @click.argument("asg_seed")
-@click.argument("desired_capacity", type=int)
+@click.argument("desired_capacity", type=int, required=False)
 @click.option("--profile", type=str, default=None)
 @click.option("--region", default=None)
-def asg_update(asg_seed, desired_capacity, profile, region):
+@click.option(
+    "--rolling",
+    is_flag=True,
+    help="Replace all instances: double capacity, wait for health, scale back.",
+)
+@click.option(
+    "--max-in-flight",
+    type=int,
+    default=1,
+    help="Number of ASGs updated in parallel by --rolling.",
+)
+@click.option("--timeout", type=int, default=900)
+def asg_update(
+    asg_seed, desired_capacity, profile, region, rolling, max_in_flight, timeout
+):
     """
     Updates the desired capacity for ASGs.
 
+    With --rolling replaces the instances of all matching ASGs: the capacity is doubled, the new
+    instances must become healthy in all target groups and then the old instances are terminated.
+    DESIRED_CAPACITY is optional in this mode (defaults to the current capacity).
+
     Examples:
         # Update the desired capacity of tier3-prod-app to 6.
         uh aws asg.update tier3-prod-app 6
+
+        # Replace the instances of all tier3 prod ASGs, two ASGs at a time.
+        uh aws asg.update tier3-prod --rolling --max-in-flight=2
     """
     load_config()
 
-    for i_asg in AutoScalingGroup.list_groups(
+    if desired_capacity is None and not rolling:
+        raise click.ClickException("DESIRED_CAPACITY is required without --rolling.")
+
+    autoscaling_groups = AutoScalingGroup.list_groups(
         asg_seed, profile_name=profile, region=region
-    ):
+    )
+    for i_asg in autoscaling_groups:
         i_asg.print()
-        i_asg.update(
-            desired_capacity=desired_capacity,
+
+    if not rolling:
+        for i_asg in autoscaling_groups:
+            i_asg.update(
+                desired_capacity=desired_capacity,
+            )
+        return
+
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max(max_in_flight, 1)) as executor:
+        futures = {
+            executor.submit(
+                i.rolling_update, desired_capacity=desired_capacity, timeout=timeout
+            ): i
+            for i in autoscaling_groups
+        }
+        for i_future in concurrent.futures.as_completed(futures):
+            try:
+                i_future.result()
+            except Exception as e:
+                print(f"* {futures[i_future].name}: ERROR: {e}")
+                failures.append(futures[i_future])
+    if failures:
+        raise click.ClickException(
+            f"Rolling update failed for: {', '.join(i.name for i in failures)}"
         )
 
 
@@ -1,6 +1,12 @@
+import concurrent.futures
+import sys
+import time
+
 import boto3
 
 from .image import Image
+from .image_usage import ImageUsageIndex
+from .target_health import TargetHealthIndex
 from .utils import get_resource_attr
 
 
@@ -27,15 +33,52 @@ class AutoScalingGroup:
         print(f"AWS_PROFILE={profile_name}")
         print(f"AWS_REGION={region}")
         session = boto3.Session(profile_name=profile_name, region_name=region)
-        autoscaling = session.client("autoscaling")
+        image_usage_index = ImageUsageIndex.build(
+            session.client("ec2"), session.client("autoscaling"), region
+        )
+
+        autoscaling_groups = [
+            i_asg
+            for i_name, i_asg in image_usage_index.autoscaling_groups.items()
+            if i_name.startswith(asg_seed)
+        ]
+
+        # Resolve the images of all matching groups with a single call.
+        image_ids = {
+            image_usage_index.asg_image_id(i["AutoScalingGroupName"])
+            for i in autoscaling_groups
+        }
+        image_ids.discard(None)
+        images = {}
+        if image_ids:
+            # Filtering (instead of ImageIds) ignores deregistered images.
+            for i_image in session.client("ec2").describe_images(
+                Filters=[{"Name": "image-id", "Values": sorted(image_ids)}]
+            )["Images"]:
+                images[i_image["ImageId"]] = Image.from_aws_dict(
+                    i_image, region=region, profile=profile_name
+                )
+
+        # Resolve the health of all target groups of all matching groups concurrently.
+        target_health = TargetHealthIndex.build(
+            session.client("elbv2"),
+            region,
+            target_group_arns=[
+                j for i in autoscaling_groups for j in i.get("TargetGroupARNs", [])
+            ],
+        )
 
         result = []
-        autoscaling_groups = autoscaling.describe_auto_scaling_groups()
-        for i_autoscaling_group in autoscaling_groups["AutoScalingGroups"]:
-            asg_name = i_autoscaling_group["AutoScalingGroupName"]
-            if not asg_name.startswith(asg_seed):
-                continue
-            autoscaling_group = cls(session, i_autoscaling_group)
+        for i_autoscaling_group in autoscaling_groups:
+            image_id = image_usage_index.asg_image_id(
+                i_autoscaling_group["AutoScalingGroupName"]
+            )
+            image = images.get(image_id) or Image(
+                image_id=image_id, name="?", region=region, profile=profile_name
+            )
+            autoscaling_group = cls(
+                session, i_autoscaling_group, image, target_health=target_health
+            )
             result.append(autoscaling_group)
 
         if not result:
@@ -43,30 +86,27 @@ class AutoScalingGroup:
 
         return result
 
-    def __init__(self, session, asg_dict):
+    def __init__(self, session, asg_dict, image, target_health=None):
         self._session = session
         ec2_resource = self._session.resource("ec2")
-        elbv2_client = self._session.client("elbv2")
-        autoscaling_client = self._session.client("autoscaling")
+        # Clients are created here so the group can be updated from a worker thread.
+        self._elbv2_client = elbv2_client = self._session.client("elbv2")
+        self._autoscaling_client = autoscaling_client = self._session.client(
+            "autoscaling"
+        )
 
         self.name = asg_dict["AutoScalingGroupName"]
+        self.region = session.region_name
         self.desired_capacity = asg_dict["DesiredCapacity"]
         self.max_size = asg_dict["MaxSize"]
+        self.target_group_arns = asg_dict.get("TargetGroupARNs", [])
 
-        image_id = self._get_image_id_from_launch_data(self._session, asg_dict)
-        self.image = Image.from_image_id(session, image_id)
+        self.image = image
 
-        # Create a map from ec2 instance id to their health status in this
-        # autoscaling group.
-        try:
-            elb_health = {
-                i["Target"]["Id"]: i["TargetHealth"]["State"]
-                for i in elbv2_client.describe_target_health(
-                    TargetGroupArn=asg_dict["TargetGroupARNs"][0]
-                )["TargetHealthDescriptions"]
-            }
-        except IndexError:
-            elb_health = {}
+        if target_health is None:
+            target_health = TargetHealthIndex.build(
+                elbv2_client, session.region_name, self.target_group_arns
+            )
 
         # TODO: Replace these dicts wiht Instance objects.
         self._instances = asg_dict["Instances"]
@@ -85,7 +125,9 @@ class AutoScalingGroup:
                 j_instance["image.name"] = get_resource_attr(
                     ec2_instances[instance_id], "image.name"
                 )
-                j_instance["elb.HealthStatus"] = elb_health.get(instance_id, "?")
+                j_instance["elb.HealthStatus"] = target_health.health(
+                    instance_id, self.target_group_arns
+                )
 
         instance_refreshes = autoscaling_client.describe_instance_refreshes(
             AutoScalingGroupName=self.name
@@ -118,39 +160,14 @@ class AutoScalingGroup:
             )
         return result
 
-    @classmethod
-    def _get_image_id_from_launch_data(cls, session, asg_dict):
-        autoscaling_client = session.client("autoscaling")
-        ec2_client = session.client("ec2")
-
-        if "LaunchConfigurationName" in asg_dict:
-            launch_configurations = autoscaling_client.describe_launch_configurations(
-                LaunchConfigurationNames=[asg_dict["LaunchConfigurationName"]]
-            )["LaunchConfigurations"]
-            return launch_configurations[0]["ImageId"]
-        else:
-            launch_template_id = asg_dict["LaunchTemplate"]["LaunchTemplateId"]
-            launch_template = ec2_client.describe_launch_templates(
-                LaunchTemplateIds=[launch_template_id]
-            )
-            launch_template_version = launch_template["LaunchTemplates"][0][
-                "LatestVersionNumber"
-            ]
-            launch_template_version = ec2_client.describe_launch_template_versions(
-                LaunchTemplateId=launch_template_id,
-                Versions=[str(launch_template_version)],
-            )
-            return launch_template_version["LaunchTemplateVersions"][0][
-                "LaunchTemplateData"
-            ]["ImageId"]
-
     def start_instance_refresh(self):
         """
         Replaces instances using ASG "instance refresh" feature.
+
+        Returns the instance refresh id.
         """
-        asg_name = self["AutoScalingGroupName"]
-        return self._autoscaling_client.start_instance_refresh(
-            AutoScalingGroupName=asg_name,
+        response = self._autoscaling_client.start_instance_refresh(
+            AutoScalingGroupName=self.name,
             Strategy="Rolling",
             Preferences={
                 "MinHealthyPercentage": 50,
@@ -159,45 +176,289 @@ class AutoScalingGroup:
                 # 'CheckpointDelay': 60
             },
         )
+        return response["InstanceRefreshId"]
 
     def update(self, desired_capacity):
+        """
+        Updates the ASG desired capacity (increasing max size if needed).
+        """
+        self._autoscaling_client.update_auto_scaling_group(
+            AutoScalingGroupName=self.name,
+            DesiredCapacity=desired_capacity,
+            MaxSize=max(self.max_size, desired_capacity),
+        )
+
+    def rolling_update(self, desired_capacity=None, timeout=900, poll_interval=10):
         """
         Replaces instances using a custom algorithm:
             * DOUBLE the number of instances;
-            * WAIT for the new instances to take over;
-            * HALVE the number of instances back to normal;
+            * WAIT for the new instances to take over (in service and healthy in all target
+              groups);
+            * HALVE the number of instances back to normal, terminating the old instances;
+
+        Every instance not terminated when the update starts (including pending ones) is an old
+        instance. If the new instances do not take over, the original capacity is restored and
+        the error is raised.
+
+        Returns the list of new instance ids.
         """
-        autoscaling_client = self._session.client("autoscaling")
-        autoscaling_client.update_auto_scaling_group(
+        desired_capacity = (
+            self.desired_capacity if desired_capacity is None else desired_capacity
+        )
+        old_instance_ids = self._describe_instance_ids(lifecycle_state=None)
+        if not old_instance_ids or desired_capacity == 0:
+            self.update(desired_capacity)
+            return []
+
+        replacements = desired_capacity
+        self._msg(f"scaling out to {len(old_instance_ids) + replacements} instance(s)")
+        self._autoscaling_client.update_auto_scaling_group(
+            AutoScalingGroupName=self.name,
+            DesiredCapacity=len(old_instance_ids) + replacements,
+            MaxSize=max(self.max_size, len(old_instance_ids) + replacements),
+        )
+
+        try:
+            new_instance_ids = self._wait_new_instances(
+                old_instance_ids, replacements, timeout, poll_interval
+            )
+        except BaseException:
+            launched = [
+                i
+                for i in self._describe_instance_ids(lifecycle_state=None)
+                if i not in old_instance_ids
+            ]
+            self._msg(
+                f"update failed, restoring capacity to {self.desired_capacity} "
+                f"(the ASG termination policy chooses which of the {len(launched)} new "
+                f"instance(s) {', '.join(launched)} or old instance(s) to terminate)"
+            )
+            self._autoscaling_client.update_auto_scaling_group(
+                AutoScalingGroupName=self.name,
+                DesiredCapacity=self.desired_capacity,
+                MaxSize=self.max_size,
+            )
+            raise
+
+        self._msg(f"terminating {len(old_instance_ids)} old instance(s)")
+        for i_instance_id in old_instance_ids:
+            self._autoscaling_client.terminate_instance_in_auto_scaling_group(
+                InstanceId=i_instance_id, ShouldDecrementDesiredCapacity=True
+            )
+        self._autoscaling_client.update_auto_scaling_group(
             AutoScalingGroupName=self.name,
             DesiredCapacity=desired_capacity,
             MaxSize=max(self.max_size, desired_capacity),
         )
+        self._msg("done")
+        return new_instance_ids
+
+    def _msg(self, msg):
+        print(f"* {self.name}: {msg}")
+
+    def _describe_instance_ids(self, lifecycle_state="InService"):
+        """
+        Returns the ids of the instances in the given lifecycle state or, if None, of all the
+        instances not being terminated.
+        """
+        asg_dict = self._autoscaling_client.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[self.name]
+        )["AutoScalingGroups"][0]
+        if lifecycle_state is None:
+            return [
+                i["InstanceId"]
+                for i in asg_dict["Instances"]
+                if not i["LifecycleState"].startswith("Terminat")
+            ]
+        return [
+            i["InstanceId"]
+            for i in asg_dict["Instances"]
+            if i["LifecycleState"] == lifecycle_state
+        ]
+
+    def _describe_healthy_targets(self):
+        """
+        Returns the ids of the targets healthy in all target groups of this ASG.
+        """
+        if not self.target_group_arns:
+            return None
+
+        def _healthy(target_group_arn):
+            return {
+                i["Target"]["Id"]
+                for i in self._elbv2_client.describe_target_health(
+                    TargetGroupArn=target_group_arn
+                )["TargetHealthDescriptions"]
+                if i["TargetHealth"]["State"] == "healthy"
+            }
+
+        with concurrent.futures.ThreadPoolExecutor(
+            len(self.target_group_arns)
+        ) as executor:
+            return set.intersection(*executor.map(_healthy, self.target_group_arns))
+
+    def _wait_new_instances(self, old_instance_ids, count, timeout, poll_interval):
+        """
+        Wait for `count` new instances in service and healthy on all target groups.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            new_instance_ids = [
+                i for i in self._describe_instance_ids() if i not in old_instance_ids
+            ]
+            if len(new_instance_ids) >= count:
+                healthy = self._describe_healthy_targets()
+                if healthy is None:
+                    return new_instance_ids
+                healthy_count = len(healthy.intersection(new_instance_ids))
+                if healthy_count >= count:
+                    return new_instance_ids
+                self._msg(f"waiting health checks ({healthy_count} of {count} healthy)")
+            else:
+                self._msg(
+                    f"waiting instances ({len(new_instance_ids)} of {count} in service)"
+                )
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"{self.name}: New instances not healthy after {timeout} seconds."
+                )
+            time.sleep(poll_interval)
+
+
+class InstanceRefreshMonitor:
+    """
+    Tracks instance-refreshes of many autoscaling groups until all of them finish.
+
+    There is no way to describe the instance-refreshes of many groups with a single API call, so
+    each poll issues one describe_instance_refreshes per group, all of them concurrently.
+    """
+
+    IN_PROGRESS_STATUSES = {
+        "Pending",
+        "InProgress",
+        "Cancelling",
+        "RollbackInProgress",
+        "Baking",
+    }
+    SUCCESS_STATUSES = {"Successful"}
+
+    def __init__(self):
+        # Maps (region, autoscaling group name) to (autoscaling group, instance refresh id):
+        # groups with the same name may exist in many regions.
+        self._tracked = {}
+        self._refreshes = {}
+
+    @classmethod
+    def _key(cls, autoscaling_group):
+        return (autoscaling_group.region, autoscaling_group.name)
+
+    @classmethod
+    def _label(cls, key):
+        region, name = key
+        return f"{name} ({region})"
+
+    def track(self, autoscaling_group, instance_refresh_id):
+        self._tracked[self._key(autoscaling_group)] = (
+            autoscaling_group,
+            instance_refresh_id,
+        )
+
+    def track_in_progress(self, autoscaling_group):
+        """
+        Tracks the instance-refreshes in progress for the given group (if any).
+
+        Returns whether there is an instance-refresh in progress.
+        """
+        for i_refresh in autoscaling_group._instance_refreshes:
+            if i_refresh["Status"] in self.IN_PROGRESS_STATUSES:
+                self.track(autoscaling_group, i_refresh["InstanceRefreshId"])
+                self._refreshes[self._key(autoscaling_group)] = i_refresh
+                return True
+        return False
+
+    def poll(self):
+        """
+        Updates the state of all tracked instance-refreshes.
+        """
+
+        def _describe(key):
+            autoscaling_group, instance_refresh_id = self._tracked[key]
+            return autoscaling_group._autoscaling_client.describe_instance_refreshes(
+                AutoScalingGroupName=autoscaling_group.name,
+                InstanceRefreshIds=[instance_refresh_id],
+            )["InstanceRefreshes"][0]
+
+        pending = [
+            i
+            for i in self._tracked
+            if self._refreshes.get(i, {}).get("Status", "Pending")
+            in self.IN_PROGRESS_STATUSES
+        ]
+        if not pending:
+            return
+        with concurrent.futures.ThreadPoolExecutor(min(len(pending), 16)) as executor:
+            for i_key, i_refresh in zip(pending, executor.map(_describe, pending)):
+                self._refreshes[i_key] = i_refresh
+
+    def in_progress(self):
+        return any(
+            self._refreshes.get(i, {}).get("Status", "Pending")
+            in self.IN_PROGRESS_STATUSES
+            for i in self._tracked
+        )
+
+    def failures(self):
+        """
+        Returns the labels ("<name> (<region>)") of the groups whose instance-refresh failed.
+        """
+        return [
+            self._label(i)
+            for i in sorted(self._tracked)
+            if self._refreshes.get(i, {}).get("Status", "Pending")
+            not in self.IN_PROGRESS_STATUSES | self.SUCCESS_STATUSES
+        ]
+
+    def lines(self):
+        result = []
+        for i_key in sorted(self._tracked):
+            refresh = self._refreshes.get(i_key, {})
+            status = refresh.get("Status", "Pending")
+            percent = refresh.get("PercentageComplete", 0)
+            instances = refresh.get("InstancesToUpdate", "?")
+            line = (
+                f"{self._label(i_key)}: {status} {percent:3d}% "
+                f"({instances} instance(s) to update)"
+            )
+            if refresh.get("StatusReason") and status not in self.SUCCESS_STATUSES:
+                line += f" - {refresh['StatusReason']}"
+            result.append(line)
+        return result
+
+    def run(self, interval=15, timeout=3600):
+        """
+        Polls the instance-refreshes until all of them finish, redrawing their status in the
+        console after each poll.
+
+        Returns the labels of the groups whose instance-refresh did not succeed.
+        """
+        deadline = time.monotonic() + timeout
+        lines = []
+        while True:
+            self.poll()
+            if lines and sys.stdout.isatty():
+                print(f"\x1b[{len(lines)}A\x1b[0J", end="")
+            lines = self.lines()
+            print("\n".join(lines), flush=True)
+            if not self.in_progress():
+                return self.failures()
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"Instance refreshes still in progress after {timeout} seconds."
+                )
+            time.sleep(interval)
 
 
-# def handle_instance_refreshes(asg):
-#     """
-#     Handles instace-refreshes associated with the given ASG.
-#
-#     Returns True if there's any instance-refresh in progress.
-#     """
-#     result = False
-#     for j_refresh in asg["InstanceRefreshes"]:
-#         if j_refresh["Status"] in ["Pending", "InProgress"]:
-#             result = True
-#             print(
-#                 f"  >> NOTICE: Instance refresh in progress: {j_refresh.get('StatusReason', '')}"
-#             )
-#         elif j_refresh["Status"] == "Successful":
-#             # Ignore successful instance refreshes.
-#             pass
-#         else:
-#             raise RuntimeError(
-#                 f"Instance refresh in an unkonwn state: {j_refresh}"
-#             )
-#     return result
-#
-#
 # def handle_autoscaling_instances(asg, image_id_asg):
 #     """
 #     Check if any instance associated with the ASG is running with a AMI
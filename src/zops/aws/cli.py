@@ -13,6 +13,7 @@ def main():
 main.add_command(commands.ami_build)
 main.add_command(commands.ami_deregister)
 main.add_command(commands.ami_list)
+main.add_command(commands.ami_prune)
 main.add_command(commands.asg_instance_refresh, "asg.instance-refresh")
 main.add_command(commands.asg_list)
 main.add_command(commands.asg_update)
@@ -1,3 +1,4 @@
+import concurrent.futures
 import copy
 import functools
 import os
@@ -9,7 +10,9 @@ import boto3
 import click
 
 from .image import Image
+from .image_usage import ImageUsageIndex
 from .instance import Instance
+from .target_health import TargetHealthIndex
 from .utils import format_date
 from .utils import get_resource_attr
 from .utils_shell import packer
@@ -220,6 +223,11 @@ class Cluster:
         region = region or self.regions[0]
         return self._session.client("autoscaling", region_name=region)
 
+    @functools.lru_cache()
+    def elbv2(self, region=None):
+        region = region or self.regions[0]
+        return self._session.client("elbv2", region_name=region)
+
     @functools.lru_cache()
     def ec2_resource(self, region=None):
         region = region or self.regions[0]
@@ -255,20 +263,90 @@ class Cluster:
     def _session(self):
         return boto3.Session(profile_name=self.profile)
 
+    def _create_clients(self, regions, clients=("ec2",)):
+        """
+        Creates (and caches) the given clients for each region, returning a map from client
+        name to a map from region to client.
+
+        boto3 clients are thread safe but the session creating them is not, so code that
+        fans out to worker threads must create the clients it uses here, beforehand.
+        """
+        return {
+            i_name: {j_region: getattr(self, i_name)(j_region) for j_region in regions}
+            for i_name in clients
+        }
+
+    def _map_regions(self, fn, regions, clients=("ec2",)):
+        """
+        Calls fn(region) concurrently for each of the given regions, returning a map from
+        region to result. The given clients are created up front (see _create_clients).
+        """
+        self._create_clients(regions, clients)
+        with concurrent.futures.ThreadPoolExecutor(len(regions) or 1) as executor:
+            return dict(zip(regions, executor.map(fn, regions)))
+
     @functools.lru_cache()
     def list_images(self, regions=None):
         """
         List AMI images for this cluster.
         Return a list of dictionary with the keys defined in image_keys.
         """
-        result = []
         regions = regions or self.regions
-        for i_region in regions:
-            for i in self.ec2_resource(i_region).images.filter(Owners=self.AWS_OWNERS):
-                image = Image.from_aws_ami(i, region=i_region, profile=self.profile)
-                result.append(image)
+
+        def _list_region_images(region):
+            pages = (
+                self.ec2(region)
+                .get_paginator("describe_images")
+                .paginate(Owners=self.AWS_OWNERS)
+            )
+            return [
+                Image.from_aws_dict(j, region=region, profile=self.profile)
+                for i_page in pages
+                for j in i_page["Images"]
+            ]
+
+        result = []
+        for i_images in self._map_regions(_list_region_images, regions).values():
+            result += i_images
         return result
 
+    @functools.lru_cache()
+    def image_usage_index(self, region=None):
+        """
+        Returns the ImageUsageIndex (AMI id => resources using it) for the given region.
+        """
+        region = region or self.regions[0]
+        return ImageUsageIndex.build(self.ec2(region), self.autoscaling(region), region)
+
+    @functools.lru_cache()
+    def image_usage_indexes(self, regions=None):
+        """
+        Returns a map from region to ImageUsageIndex, building the indexes concurrently.
+        """
+        regions = regions or self.regions
+        return self._map_regions(
+            self.image_usage_index, regions, clients=("ec2", "autoscaling")
+        )
+
+    def list_images_in_use(self, regions=None):
+        """
+        Returns the set of AMI ids referenced by autoscaling groups, instances, launch templates
+        and launch configurations in the given regions.
+        """
+        result = set()
+        for i_index in self.image_usage_indexes(regions).values():
+            result |= i_index.image_ids()
+        return frozenset(result)
+
+    @functools.lru_cache()
+    def target_health_index(self, region=None):
+        """
+        Returns the TargetHealthIndex (instance id => health) of all ELBv2 target groups in the
+        given region.
+        """
+        region = region or self.regions[0]
+        return TargetHealthIndex.build(self.elbv2(region), region)
+
     @functools.lru_cache()
     def list_instances(self, region, sort_by="launch_time"):
         ec2 = self.ec2_resource(region)
@@ -304,6 +382,36 @@ class Cluster:
             image_os=image_os,
         )
 
+    def deregister_images(self, images, delete_snapshots=True, jobs=8, yes=False):
+        """
+        Deregister the given images (and the snapshots backing them) using up to
+        `jobs` concurrent API calls.
+
+        Returns a list of (image, exception) for the images that failed.
+        """
+
+        def _deregister(image, ec2_client):
+            image.msg("DEREGISTER")
+            image.deregister(
+                yes=yes, delete_snapshots=delete_snapshots, ec2_client=ec2_client
+            )
+
+        ec2_clients = self._create_clients({i.region for i in images})["ec2"]
+        result = []
+        with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as executor:
+            futures = {
+                executor.submit(_deregister, i, ec2_clients[i.region]): i
+                for i in images
+            }
+            for i_future in concurrent.futures.as_completed(futures):
+                image = futures[i_future]
+                try:
+                    i_future.result()
+                except Exception as e:
+                    image.msg(f"ERROR: {e}")
+                    result.append((image, e))
+        return result
+
     def get_instance_by_name(self, instance_name, state="running"):
         region = self.regions[0]
         result = self.ec2_resource(region).instances.filter(
@@ -532,27 +640,7 @@ def list_autoscaling_groups(asg_filter, region="ca-central-1"):
             result = super().__init__(*args, **kwargs)
             ec2_client = session.client("ec2")
 
-            if "LaunchConfigurationName" in self:
-                launch_configurations = autoscaling.describe_launch_configurations(
-                    LaunchConfigurationNames=[self["LaunchConfigurationName"]]
-                )["LaunchConfigurations"]
-                image_id = launch_configurations[0]["ImageId"]
-            else:
-                launch_template_id = self["LaunchTemplate"]["LaunchTemplateId"]
-                launch_template = ec2_client.describe_launch_templates(
-                    LaunchTemplateIds=[launch_template_id]
-                )
-                launch_template_version = launch_template["LaunchTemplates"][0][
-                    "LatestVersionNumber"
-                ]
-                launch_template_version = ec2_client.describe_launch_template_versions(
-                    LaunchTemplateId=launch_template_id,
-                    Versions=[str(launch_template_version)],
-                )
-                image_id = launch_template_version["LaunchTemplateVersions"][0][
-                    "LaunchTemplateData"
-                ]["ImageId"]
-
+            image_id = image_usage_index.asg_image_id(self["AutoScalingGroupName"])
             self["ImageId"] = image_id
             image_name = ec2_client.describe_images(ImageIds=[image_id])
             try:
@@ -641,11 +729,11 @@ def list_autoscaling_groups(asg_filter, region="ca-central-1"):
     autoscaling = session.client("autoscaling")
     ec2 = session.resource("ec2")
     elb = session.client("elbv2")
+    image_usage_index = ImageUsageIndex.build(
+        session.client("ec2"), autoscaling, region
+    )
     result = []
-    for i_autoscaling_group in autoscaling.describe_auto_scaling_groups()[
-        "AutoScalingGroups"
-    ]:
-        asg_name = i_autoscaling_group["AutoScalingGroupName"]
+    for asg_name, i_autoscaling_group in image_usage_index.autoscaling_groups.items():
         if not asg_name.startswith(asg_filter):
             continue
 
@@ -1,6 +1,6 @@
-import boto3
+import datetime
 
-from .utils import get_resource_attr
+import boto3
 
 
 class Image:
@@ -14,6 +14,9 @@ class Image:
     * This object fullfil the following objectives:
       * List AMI images;
       * Build, Copy, Tag and Share images.
+
+    Clusters can list tens of thousands of (shared) images, so this is a compact record (no
+    instance __dict__) built directly from describe_images dicts.
     """
 
     _ATTRS = [
@@ -30,9 +33,24 @@ class Image:
         "region",
     ]
 
+    # Maps attributes to keys in the describe_images dicts.
+    _AWS_KEYS = {
+        "image_id": "ImageId",
+        "name": "Name",
+        "owner_id": "OwnerId",
+        "creation_date": "CreationDate",
+        "state": "State",
+    }
+
+    __slots__ = tuple(i if isinstance(i, str) else i[0] for i in _ATTRS) + (
+        # List of (snapshot_id, volume_size) for the EBS volumes backing this image.
+        "snapshots",
+    )
+
     def __init__(self, **kwargs):
         for i_name, i_seed in self._iter_attrs():
             setattr(self, i_name, kwargs.get(i_name))
+        self.snapshots = kwargs.get("snapshots") or ()
 
     def __str__(self):
         return f"<Image {self.display_name} profile={self.profile} image_id={self.image_id}>"
@@ -46,23 +64,46 @@ class Image:
 
     @classmethod
     def from_image_id(cls, session, image_id):
-        return cls.from_aws_ami(session.resource("ec2").Image(image_id))
+        images = session.client("ec2").describe_images(ImageIds=[image_id])["Images"]
+        if not images:
+            return cls(image_id=image_id, name="?", region=session.region_name)
+        return cls.from_aws_dict(images[0], region=session.region_name)
 
     @classmethod
     def from_aws_ami(cls, aws_ami, region="INVALID", profile="INVALID"):
         """
         Create an Image instance from a AWS AMI instance.
         """
-        d = {}
-        for i_name, i_seed in cls._iter_attrs():
-            d[i_name] = get_resource_attr(aws_ami, i_seed)
-        d.update(
-            {
-                "region": region,
-                "profile": profile,
-            }
+        if aws_ami.meta.data is None:
+            aws_ami.load()
+        return cls.from_aws_dict(aws_ami.meta.data, region=region, profile=profile)
+
+    @classmethod
+    def from_aws_dict(cls, aws_dict, region="INVALID", profile="INVALID"):
+        """
+        Create an Image instance from a describe_images dict in a single pass.
+        """
+        result = cls(
+            region=region,
+            profile=profile,
+            **{i: aws_dict.get(j) for i, j in cls._AWS_KEYS.items()},
+        )
+
+        tags = {i["Key"].lower(): i["Value"] for i in aws_dict.get("Tags", ())}
+        result.tag_name = tags.get("name", "") if tags else "-"
+        result.tag_version = tags.get("version", "") if tags else "-"
+
+        if result.creation_date:
+            result.creation_date = datetime.datetime.fromisoformat(
+                result.creation_date
+            ).strftime("%Y-%m-%d %H:%M")
+
+        result.snapshots = tuple(
+            (i["Ebs"]["SnapshotId"], i["Ebs"].get("VolumeSize", 0))
+            for i in aws_dict.get("BlockDeviceMappings", ())
+            if "SnapshotId" in i.get("Ebs", {})
         )
-        return cls(**d)
+        return result
 
     def split_name(self):
         assert self.name is not None
@@ -75,6 +116,13 @@ class Image:
     def exists(self):
         return self.image_id is not None
 
+    @property
+    def snapshots_size(self):
+        """
+        Total size (GiB) of the EBS volumes backing this image.
+        """
+        return sum(i_size for _snapshot_id, i_size in self.snapshots)
+
     @property
     def tagged(self):
         return self.tag_name is None or self.tag_version is None
@@ -113,17 +161,30 @@ class Image:
             LaunchPermission=dict(Add=[dict(UserId=str(aws_id))]),
         )
 
-    def deregister(self, yes=False):
+    def deregister(self, yes=False, delete_snapshots=False, ec2_client=None):
+        """
+        Deregister this image, optionally deleting the snapshots backing it.
+
+        Snapshots can only be deleted after the image is deregistered, so they are deleted in
+        sequence, after the deregister call.
+        """
         if not self.exists:
             return
 
+        snapshot_ids = [i for i, _size in self.snapshots] if delete_snapshots else []
+
         if not yes:
             print(f"$ aws ec2 deregister-image --image-id={self.image_id}")
+            for i_snapshot_id in snapshot_ids:
+                print(f"$ aws ec2 delete-snapshot --snapshot-id={i_snapshot_id}")
             return
 
-        session = boto3.Session(profile_name=self.profile, region_name=self.region)
-        ec2 = session.client("ec2")
-        ec2.deregister_image(ImageId=self.image_id)
+        if ec2_client is None:
+            session = boto3.Session(profile_name=self.profile, region_name=self.region)
+            ec2_client = session.client("ec2")
+        ec2_client.deregister_image(ImageId=self.image_id)
+        for i_snapshot_id in snapshot_ids:
+            ec2_client.delete_snapshot(SnapshotId=i_snapshot_id)
 
     def auto_tag(self, yes=False):
         """
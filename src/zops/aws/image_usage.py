@@ -0,0 +1,193 @@
+INSTANCE_ACTIVE_STATES = ["pending", "running", "stopping", "stopped"]
+
+
+class ImageUsage:
+    """
+    Resources using an AMI image in a region.
+    """
+
+    __slots__ = (
+        "image_id",
+        "autoscaling_groups",
+        "launch_templates",
+        "launch_configurations",
+        "instances",
+    )
+
+    def __init__(self, image_id):
+        self.image_id = image_id
+        self.autoscaling_groups = set()
+        self.launch_templates = set()
+        self.launch_configurations = set()
+        self.instances = set()
+
+    def __str__(self):
+        result = [f"asg:{i}" for i in sorted(self.autoscaling_groups)]
+        result += [f"lt:{i}" for i in sorted(self.launch_templates)]
+        result += [f"lc:{i}" for i in sorted(self.launch_configurations)]
+        if self.instances:
+            result.append(f"{len(self.instances)} instance(s)")
+        return ", ".join(result)
+
+
+class ImageUsageIndex:
+    """
+    Maps AMI ids to the resources using them (autoscaling groups, launch template versions,
+    launch configurations and instances) in a single region.
+
+    The index is built with a handful of paginated bulk describe calls, instead of resolving the
+    launch data of each autoscaling group separately:
+
+    * describe_launch_template_versions for the $Latest and $Default versions of all templates;
+    * describe_launch_template_versions for each template with other versions referenced by ASGs;
+    * describe_launch_configurations;
+    * describe_auto_scaling_groups;
+    * describe_instances.
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.autoscaling_groups = {}
+        self._usages = {}
+        self._asg_images = {}
+
+    def __contains__(self, image_id):
+        return image_id in self._usages
+
+    def image_ids(self):
+        return frozenset(self._usages)
+
+    def used_by(self, image_id):
+        """
+        Returns the ImageUsage for the given image or None if the image is not in use.
+        """
+        return self._usages.get(image_id)
+
+    def asg_image_id(self, asg_name):
+        """
+        Returns the AMI id associated with the launch data of the given autoscaling group.
+        """
+        return self._asg_images.get(asg_name)
+
+    def _usage(self, image_id):
+        result = self._usages.get(image_id)
+        if result is None:
+            result = self._usages[image_id] = ImageUsage(image_id)
+        return result
+
+    @classmethod
+    def build(cls, ec2_client, autoscaling_client, region):
+        result = cls(region)
+
+        # (launch template id, version) => (launch template name, image id)
+        lt_versions = {}
+        lt_latest = {}
+        lt_default = {}
+        result._add_launch_template_versions(
+            ec2_client,
+            lt_versions,
+            lt_latest,
+            lt_default,
+            Versions=["$Latest", "$Default"],
+        )
+
+        lc_images = {}
+        pages = autoscaling_client.get_paginator("describe_launch_configurations")
+        for i_page in pages.paginate():
+            for j_config in i_page["LaunchConfigurations"]:
+                lc_images[j_config["LaunchConfigurationName"]] = j_config["ImageId"]
+
+        pages = autoscaling_client.get_paginator("describe_auto_scaling_groups")
+        for i_page in pages.paginate():
+            for j_asg in i_page["AutoScalingGroups"]:
+                result.autoscaling_groups[j_asg["AutoScalingGroupName"]] = j_asg
+
+        # Launch template versions referenced by ASGs that are neither $Latest nor $Default.
+        asg_templates = {}
+        missing_versions = {}
+        for i_name, i_asg in result.autoscaling_groups.items():
+            spec = cls._launch_template_spec(i_asg)
+            if spec is None:
+                continue
+            lt_id, version = spec
+            version = (
+                {"$Latest": lt_latest, "$Default": lt_default}
+                .get(version, {})
+                .get(lt_id, version)
+            )
+            asg_templates[i_name] = (lt_id, str(version))
+            if (lt_id, str(version)) not in lt_versions:
+                missing_versions.setdefault(lt_id, set()).add(str(version))
+        for i_lt_id, i_versions in missing_versions.items():
+            result._add_launch_template_versions(
+                ec2_client,
+                lt_versions,
+                lt_latest,
+                lt_default,
+                LaunchTemplateId=i_lt_id,
+                Versions=sorted(i_versions),
+            )
+
+        for (i_lt_id, i_version), (i_lt_name, i_image_id) in lt_versions.items():
+            if i_image_id:
+                result._usage(i_image_id).launch_templates.add(
+                    f"{i_lt_name}:{i_version}"
+                )
+
+        for i_lc_name, i_image_id in lc_images.items():
+            result._usage(i_image_id).launch_configurations.add(i_lc_name)
+
+        for i_name, i_asg in result.autoscaling_groups.items():
+            if i_name in asg_templates:
+                image_id = lt_versions.get(asg_templates[i_name], (None, None))[1]
+            else:
+                image_id = lc_images.get(i_asg.get("LaunchConfigurationName"))
+            if image_id:
+                result._asg_images[i_name] = image_id
+                result._usage(image_id).autoscaling_groups.add(i_name)
+
+        pages = ec2_client.get_paginator("describe_instances").paginate(
+            Filters=[{"Name": "instance-state-name", "Values": INSTANCE_ACTIVE_STATES}]
+        )
+        for i_page in pages:
+            for j_reservation in i_page["Reservations"]:
+                for k_instance in j_reservation["Instances"]:
+                    result._usage(k_instance["ImageId"]).instances.add(
+                        k_instance["InstanceId"]
+                    )
+
+        return result
+
+    @classmethod
+    def _launch_template_spec(cls, asg_dict):
+        """
+        Returns (launch template id, version) for the given ASG or None if it uses a launch
+        configuration.
+        """
+        spec = asg_dict.get("LaunchTemplate")
+        if spec is None:
+            spec = (
+                asg_dict.get("MixedInstancesPolicy", {})
+                .get("LaunchTemplate", {})
+                .get("LaunchTemplateSpecification")
+            )
+        if spec is None:
+            return None
+        return spec["LaunchTemplateId"], spec.get("Version", "$Default")
+
+    @classmethod
+    def _add_launch_template_versions(
+        cls, ec2_client, lt_versions, lt_latest, lt_default, **kwargs
+    ):
+        pages = ec2_client.get_paginator("describe_launch_template_versions")
+        for i_page in pages.paginate(**kwargs):
+            for j_version in i_page["LaunchTemplateVersions"]:
+                lt_id = j_version["LaunchTemplateId"]
+                version = j_version["VersionNumber"]
+                lt_versions[(lt_id, str(version))] = (
+                    j_version["LaunchTemplateName"],
+                    j_version["LaunchTemplateData"].get("ImageId"),
+                )
+                lt_latest[lt_id] = max(lt_latest.get(lt_id, 0), version)
+                if j_version.get("DefaultVersion"):
+                    lt_default[lt_id] = version
@@ -33,6 +33,10 @@ class Instance:
             "profile": self.__cluster.profile,
             "region": self.__region,
         }
+        if "elb.health" in keys:
+            extra_keys["elb.health"] = self.__cluster.target_health_index(
+                self.__region
+            ).health(self.__instance.instance_id)
         return [
             extra_keys.get(k_key, False) or get_resource_attr(self.__instance, k_key)
             for k_key in keys
@@ -0,0 +1,71 @@
+import datetime
+
+
+class RetentionPolicy:
+    """
+    Retention rules for AMI images.
+
+    An image is kept if any of the rules below applies, otherwise it is selected for deletion:
+
+    * The image is in use (referenced by an instance, launch template or launch configuration);
+    * The image is one of the `keep_latest` newest images with the same owner, tag_name and region;
+    * The image is younger than `max_age` days;
+    * The image is not owned by the cluster account (shared images can't be deregistered);
+
+    Images without a Name tag are grouped by their full name, meaning that they are only deleted
+    by age.
+    """
+
+    def __init__(self, keep_latest=None, max_age=None):
+        if keep_latest is None and max_age is None:
+            raise ValueError("At least one of keep_latest or max_age must be defined.")
+        self.keep_latest = keep_latest
+        self.max_age = max_age
+
+    @classmethod
+    def _group_key(cls, image):
+        if image.tag_name in (None, "", "-"):
+            return (image.owner_id, image.region, image.name)
+        return (image.owner_id, image.region, image.tag_name)
+
+    @classmethod
+    def _created_at(cls, image):
+        if not image.creation_date:
+            return None
+        return datetime.datetime.strptime(image.creation_date, "%Y-%m-%d %H:%M")
+
+    def evaluate(self, images, owner_id, in_use=frozenset(), now=None):
+        """
+        Evaluate the rules over the given images in a single pass (newest first).
+
+        Returns a list of (image, reason) where reason is None for the images to delete.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        max_age = (
+            None if self.max_age is None else datetime.timedelta(days=self.max_age)
+        )
+        owner_id = str(owner_id)
+
+        result = []
+        group_counts = {}
+        for i_image in sorted(
+            images, key=lambda x: x.creation_date or "", reverse=True
+        ):
+            group_key = self._group_key(i_image)
+            group_index = group_counts[group_key] = group_counts.get(group_key, 0) + 1
+            created_at = self._created_at(i_image)
+
+            if i_image.owner_id != owner_id:
+                reason = "shared"
+            elif i_image.image_id in in_use:
+                reason = "in use"
+            elif self.keep_latest is not None and group_index <= self.keep_latest:
+                reason = f"latest #{group_index}"
+            elif max_age is not None and (
+                created_at is None or now - created_at < max_age
+            ):
+                reason = "recent"
+            else:
+                reason = None
+            result.append((i_image, reason))
+        return result
@@ -0,0 +1,121 @@
+import time
+
+
+class FleetCommand:
+    """
+    Executes a shell command in many EC2 instances using SSM Run Command.
+
+    * A single send_command is issued for all targets (instances are split in chunks of 50 when
+      given by id, the SSM limit);
+    * Concurrency and error limits are handled by SSM (MaxConcurrency/MaxErrors);
+    * Progress is polled with list_command_invocations using an increasing interval, and the
+      output of each instance is fetched as soon as it finishes;
+    * The timeout (seconds) bounds the execution on each instance (executionTimeout) and the
+      time an instance may wait for the command to be delivered (TimeoutSeconds). Both may run
+      back to back, so iter_results waits up to 2 * timeout + REPORT_SLACK seconds.
+    """
+
+    DOCUMENT_NAME = "AWS-RunShellScript"
+    MAX_INSTANCE_IDS = 50
+    TERMINAL_STATUSES = {"Success", "Cancelled", "TimedOut", "Failed"}
+    # Seconds for SSM to report the results after the delivery and execution timeouts.
+    REPORT_SLACK = 60
+
+    def __init__(
+        self,
+        ssm_client,
+        command,
+        instance_ids=(),
+        targets=(),
+        max_concurrency="50",
+        max_errors="0",
+        timeout=600,
+    ):
+        self._ssm_client = ssm_client
+        self.command = command
+        self.instance_ids = list(instance_ids)
+        self.targets = list(targets)
+        self.max_concurrency = str(max_concurrency)
+        self.max_errors = str(max_errors)
+        self.timeout = timeout
+        self.command_ids = []
+
+    def send(self):
+        """
+        Sends the command to the targets, returning the list of SSM command ids.
+        """
+        kwargs = dict(
+            DocumentName=self.DOCUMENT_NAME,
+            Parameters={
+                "commands": [self.command],
+                "executionTimeout": [str(self.timeout)],
+            },
+            MaxConcurrency=self.max_concurrency,
+            MaxErrors=self.max_errors,
+            TimeoutSeconds=self.timeout,
+        )
+        if self.targets:
+            response = self._ssm_client.send_command(Targets=self.targets, **kwargs)
+            self.command_ids.append(response["Command"]["CommandId"])
+        for i in range(0, len(self.instance_ids), self.MAX_INSTANCE_IDS):
+            response = self._ssm_client.send_command(
+                InstanceIds=self.instance_ids[i : i + self.MAX_INSTANCE_IDS], **kwargs
+            )
+            self.command_ids.append(response["Command"]["CommandId"])
+        return self.command_ids
+
+    def iter_results(self, poll_interval=1, max_poll_interval=15):
+        """
+        Yields the get_command_invocation result of each instance as soon as it finishes.
+
+        The polling interval grows (up to max_poll_interval) while nothing finishes and resets
+        when new results arrive.
+        """
+        pending_commands = set(self.command_ids)
+        reported = set()
+        interval = poll_interval
+        wait_timeout = 2 * self.timeout + self.REPORT_SLACK
+        deadline = time.monotonic() + wait_timeout
+        while pending_commands:
+            time.sleep(interval)
+            finished = []
+            for i_command_id in sorted(pending_commands):
+                invocations = self._list_invocations(i_command_id)
+                finished += [
+                    (i_command_id, j["InstanceId"])
+                    for j in invocations
+                    if j["Status"] in self.TERMINAL_STATUSES
+                    and (i_command_id, j["InstanceId"]) not in reported
+                ]
+                if self._is_command_done(i_command_id, invocations):
+                    pending_commands.discard(i_command_id)
+
+            for i_command_id, i_instance_id in finished:
+                reported.add((i_command_id, i_instance_id))
+                yield self._ssm_client.get_command_invocation(
+                    CommandId=i_command_id, InstanceId=i_instance_id
+                )
+
+            if finished:
+                interval = poll_interval
+            else:
+                interval = min(interval * 1.5, max_poll_interval)
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"SSM commands still running after {wait_timeout} seconds"
+                    f" (delivery and execution timeouts of {self.timeout} seconds each): "
+                    f"{', '.join(sorted(pending_commands))}"
+                )
+
+    def _list_invocations(self, command_id):
+        pages = self._ssm_client.get_paginator("list_command_invocations").paginate(
+            CommandId=command_id
+        )
+        return [j for i_page in pages for j in i_page["CommandInvocations"]]
+
+    def _is_command_done(self, command_id, invocations):
+        command = self._ssm_client.list_commands(CommandId=command_id)["Commands"][0]
+        if command["Status"] not in self.TERMINAL_STATUSES:
+            return False
+        return all(i["Status"] in self.TERMINAL_STATUSES for i in invocations)
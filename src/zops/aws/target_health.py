@@ -0,0 +1,94 @@
+import concurrent.futures
+
+
+# Target health states from the most to the least severe.
+TARGET_STATES = [
+    "unhealthy",
+    "unhealthy.draining",
+    "draining",
+    "unavailable",
+    "initial",
+    "unused",
+    "healthy",
+]
+
+
+class TargetHealthIndex:
+    """
+    Maps EC2 instance ids to their health in ELBv2 target groups in a single region.
+
+    describe_target_health only accepts one target group, so the index issues one call per
+    target group, all of them concurrently.
+    """
+
+    def __init__(self, region):
+        self.region = region
+        # target group arn => {target id => state}
+        self._target_groups = {}
+
+    def __contains__(self, target_group_arn):
+        return target_group_arn in self._target_groups
+
+    def target_group_arns(self):
+        return frozenset(self._target_groups)
+
+    def health(self, instance_id, target_group_arns=None):
+        """
+        Returns the health state of the given instance.
+
+        When the instance is registered in more than one target group, returns the most severe
+        state. If target_group_arns is given, an instance missing from any of them is considered
+        "unused" (not registered). Returns "?" when there is no target group to check.
+        """
+        if target_group_arns is None:
+            states = [
+                i[instance_id] for i in self._target_groups.values() if instance_id in i
+            ]
+        else:
+            states = [
+                self._target_groups.get(i, {}).get(instance_id, "unused")
+                for i in target_group_arns
+            ]
+        if not states:
+            return "?"
+        return min(states, key=self._severity)
+
+    @classmethod
+    def _severity(cls, state):
+        try:
+            return TARGET_STATES.index(state)
+        except ValueError:
+            return -1
+
+    @classmethod
+    def build(cls, elbv2_client, region, target_group_arns=None, jobs=8):
+        """
+        Builds the index for the given target groups or, if None, for all target groups in the
+        region.
+        """
+        result = cls(region)
+
+        if target_group_arns is None:
+            pages = elbv2_client.get_paginator("describe_target_groups").paginate()
+            target_group_arns = [
+                j["TargetGroupArn"] for i_page in pages for j in i_page["TargetGroups"]
+            ]
+        target_group_arns = sorted(set(target_group_arns))
+        if not target_group_arns:
+            return result
+
+        def _describe(target_group_arn):
+            return {
+                i["Target"]["Id"]: i["TargetHealth"]["State"]
+                for i in elbv2_client.describe_target_health(
+                    TargetGroupArn=target_group_arn
+                )["TargetHealthDescriptions"]
+            }
+
+        with concurrent.futures.ThreadPoolExecutor(
+            min(jobs, len(target_group_arns))
+        ) as executor:
+            result._target_groups = dict(
+                zip(target_group_arns, executor.map(_describe, target_group_arns))
+            )
+        return result
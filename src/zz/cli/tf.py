@@ -4,6 +4,7 @@ import click
 
 from zerotk import deps
 from zz.services.console import Console
+from zz.services.plugin_cache import PluginCache
 from zz.services.subprocess import SubProcess
 from zz.services.terraform import Terraform
 
@@ -12,19 +13,105 @@ from zz.services.terraform import Terraform
 class TerraformCli:
 
     console = deps.Singleton(Console)
+    plugin_cache = deps.Singleton(PluginCache)
     subprocess = deps.Singleton(SubProcess)
     terraform = deps.Singleton(Terraform)
 
     @click.command("plan")
     @click.argument("deployments", nargs=-1)
     @click.option("--skip-init", is_flag=True)
+    @click.option(
+        "--force-init", is_flag=True, help="Run terraform init even if up to date."
+    )
     @click.option("--skip-plan", is_flag=True)
+    @click.option(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Concurrent report generations (default: number of CPUs).",
+    )
+    @click.option(
+        "--plan-jobs",
+        type=int,
+        default=None,
+        help="Concurrent terraform plans (default: based on CPUs and available memory).",
+    )
+    @click.option(
+        "--isolate",
+        is_flag=True,
+        help="Plan deployments of the same workdir concurrently, each one with its own TF_DATA_DIR.",
+    )
+    @click.option(
+        "--plugin-mirror",
+        default=None,
+        help="Local providers mirror (see terraform providers mirror) used by terraform init.",
+    )
+    @click.option(
+        "--incremental",
+        is_flag=True,
+        help="Reuse the previous plan of deployments whose inputs did not change.",
+    )
+    @click.option(
+        "--max-plan-age",
+        type=int,
+        default=60,
+        help="Maximum age (minutes) of plans reused by --incremental.",
+    )
+    @click.option(
+        "--lock-timeout",
+        type=int,
+        default=10,
+        help="Minutes to keep retrying deployments with a locked state.",
+    )
+    @click.option(
+        "--refresh/--no-refresh",
+        default=True,
+        help="Refresh the resources state (terraform plan -refresh=false).",
+    )
+    @click.option(
+        "--changed-since",
+        default=None,
+        metavar="GIT_REF",
+        help="Plan only the resources declared on the files changed since the given git "
+        "reference (terraform plan -target), falling back to a full plan when needed.",
+    )
+    @click.option(
+        "--parallelism",
+        type=int,
+        default=None,
+        help="Number of concurrent operations of each terraform plan.",
+    )
+    @click.option(
+        "--report-file",
+        default=None,
+        help="Write a JSON lines report (one line per deployment, as soon as it finishes, "
+        "and a summary line) to this file.",
+    )
+    @click.option(
+        "--trace-file",
+        default=None,
+        help="Write the timeline of the terraform executions (Chrome trace format) to this "
+        "file.",
+    )
     @click.option("--verbose", is_flag=True)
     def plan(
         self,
         deployments: list[str],
         skip_init: bool,
+        force_init: bool,
         skip_plan: bool,
+        jobs: int,
+        plan_jobs: int,
+        isolate: bool,
+        plugin_mirror: str,
+        incremental: bool,
+        max_plan_age: int,
+        lock_timeout: int,
+        refresh: bool,
+        changed_since: str,
+        parallelism: int,
+        report_file: str,
+        trace_file: str,
         verbose: bool,
     ) -> None:
         """
@@ -37,11 +124,61 @@ class TerraformCli:
         Eg.:
         tf plan t3can-stage apps/t3can:t3can-stage apps/t3can:t3can-stage|stage
         """
-        asyncio.run(self._tf_plan(deployments, skip_init, skip_plan, verbose))
+        self._setup_plugin_cache(plugin_mirror)
+        asyncio.run(
+            self._tf_plan(
+                deployments,
+                skip_init,
+                skip_plan,
+                verbose,
+                force_init=force_init,
+                jobs=jobs,
+                plan_jobs=plan_jobs,
+                isolate=isolate,
+                incremental=incremental,
+                max_plan_age=max_plan_age,
+                lock_timeout=lock_timeout,
+                plan_options=Terraform.PlanOptions(
+                    refresh=refresh,
+                    changed_since=changed_since,
+                    parallelism=parallelism,
+                ),
+                report_filename=report_file,
+                trace_filename=trace_file,
+            )
+        )
 
-    async def _tf_plan(self, deployments, skip_init, skip_plan, verbose):
+    async def _tf_plan(
+        self,
+        deployments,
+        skip_init,
+        skip_plan,
+        verbose,
+        force_init=False,
+        jobs=None,
+        plan_jobs=None,
+        isolate=False,
+        incremental=False,
+        max_plan_age=60,
+        lock_timeout=10,
+        plan_options=None,
+        report_filename=None,
+        trace_filename=None,
+    ):
         result = await self.terraform.generate_reports(
-            deployments, skip_init=skip_init, skip_plan=skip_plan
+            deployments,
+            skip_init=skip_init,
+            skip_plan=skip_plan,
+            force_init=force_init,
+            jobs=jobs,
+            plan_jobs=plan_jobs,
+            isolate=isolate,
+            incremental=incremental,
+            max_plan_age=max_plan_age,
+            lock_timeout=lock_timeout,
+            plan_options=plan_options,
+            report_filename=report_filename,
+            trace_filename=trace_filename,
         )
 
         self.console.title("Terraform changes report")
@@ -56,26 +193,120 @@ class TerraformCli:
     @click.command("apply")
     @click.argument("deployments", nargs=-1)
     @click.option("--skip-init", is_flag=True)
+    @click.option(
+        "--force-init", is_flag=True, help="Run terraform init even if up to date."
+    )
+    @click.option(
+        "--plugin-mirror",
+        default=None,
+        help="Local providers mirror (see terraform providers mirror) used by terraform init.",
+    )
+    @click.option(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of deployments applied concurrently (default: CPUs).",
+    )
+    @click.option(
+        "--dependencies",
+        default=None,
+        help="YAML file mapping deployments to the deployments they depend on.",
+    )
+    @click.option(
+        "--infer-dependencies",
+        is_flag=True,
+        help="Apply the deployments read by terraform_remote_state data sources first.",
+    )
+    @click.option(
+        "--keep-going",
+        is_flag=True,
+        help="After a failure, skip only the deployments depending on the failed one.",
+    )
     @click.option("--verbose", is_flag=True)
     def apply(
         self,
         deployments: list[str],
         skip_init: bool,
+        force_init: bool,
+        plugin_mirror: str,
+        jobs: int,
+        dependencies: str,
+        infer_dependencies: bool,
+        keep_going: bool,
         verbose: bool,
     ) -> None:
         """
         Terraform apply with support to multiple terraform strategies.
+
+        Independent deployments are applied concurrently, dependent deployments only after
+        their prerequisites (see --dependencies and --infer-dependencies) succeed.
         """
-        asyncio.run(self._tf_apply(deployments, skip_init=skip_init, verbose=verbose))
+        self._setup_plugin_cache(plugin_mirror)
+        asyncio.run(
+            self._tf_apply(
+                deployments,
+                skip_init=skip_init,
+                force_init=force_init,
+                verbose=verbose,
+                jobs=jobs,
+                dependencies_filename=dependencies,
+                infer_dependencies=infer_dependencies,
+                keep_going=keep_going,
+            )
+        )
 
-    async def _tf_apply(self, deployments, skip_init, verbose):
-        await self.terraform.apply(deployments, skip_init=skip_init)
+    async def _tf_apply(
+        self,
+        deployments,
+        skip_init,
+        verbose,
+        force_init=False,
+        jobs=None,
+        dependencies_filename=None,
+        infer_dependencies=False,
+        keep_going=False,
+    ):
+        await self.terraform.apply(
+            deployments,
+            skip_init=skip_init,
+            force_init=force_init,
+            jobs=jobs,
+            dependencies_filename=dependencies_filename,
+            infer_dependencies=infer_dependencies,
+            keep_going=keep_going,
+        )
 
         error_logs = [i for i in self.subprocess.execution_logs if i.is_error()]
         for i_log in error_logs:
             self.console.title(f"{i_log.cmd_line} (retcode: {i_log.retcode})")
             self.console._print(i_log.output)
 
+    def _setup_plugin_cache(self, mirror):
+        try:
+            self.plugin_cache.setup(mirror=mirror)
+        except PluginCache.ConfigError as e:
+            raise click.ClickException(str(e))
+
+    @click.command("plugin-cache")
+    @click.option(
+        "--prune",
+        type=int,
+        default=None,
+        help="Remove providers not used in the given number of days.",
+    )
+    def plugin_cache_(self, prune: int) -> None:
+        """
+        Shows (and prunes) the terraform provider plugin cache shared by zz.
+        """
+        directory = self.plugin_cache.setup()
+        if prune is not None:
+            for i_directory in self.plugin_cache.prune(prune):
+                self.console.item(f"removed {i_directory.relative_to(directory)}")
+        count, size = self.plugin_cache.summary()
+        self.console.title(
+            f"{directory}: {count} provider version(s), {size / 1024**2:.1f} MiB"
+        )
+
 
 # main = click.Group(name="tf")
 # main.add_command(TerraformCommands.as_click_command("plan"))
@@ -0,0 +1,77 @@
+import asyncio
+import fcntl
+
+import pytest
+
+from zz.services.plugin_cache import PluginCache
+
+
+LOCKFILE = """\
+provider "registry.terraform.io/hashicorp/null" {
+  version = "3.2.2"
+}
+"""
+
+
+@pytest.fixture
+def plugin_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("TF_PLUGIN_CACHE_DIR", str(tmp_path / "plugins"))
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.delenv("TF_CLI_CONFIG_FILE", raising=False)
+    return PluginCache()
+
+
+def _is_locked(lock_filename, operation):
+    with open(lock_filename, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        return False
+
+
+@pytest.mark.parametrize("cached", [True, False])
+def test_init_lock(plugin_cache, tmp_path, cached):
+    plugin_cache.setup()
+    (tmp_path / ".terraform.lock.hcl").write_text(LOCKFILE)
+    if cached:
+        provider = plugin_cache.directory / "registry.terraform.io/hashicorp/null/3.2.2"
+        provider.mkdir(parents=True)
+        (provider / "linux_amd64").mkdir()
+
+    async def _init():
+        async with plugin_cache.init_lock(tmp_path) as (hits, misses):
+            lock_filename = tmp_path / "plugins.lock"
+            return (
+                len(hits),
+                len(misses),
+                _is_locked(lock_filename, fcntl.LOCK_SH),
+                _is_locked(lock_filename, fcntl.LOCK_EX),
+            )
+
+    # Cache hits share the lock with other zz processes, downloads hold it exclusively.
+    if cached:
+        assert asyncio.run(_init()) == (1, 0, False, True)
+    else:
+        assert asyncio.run(_init()) == (0, 1, True, True)
+
+
+def test_setup_mirror_keeps_user_config(plugin_cache, tmp_path):
+    (tmp_path / ".terraformrc").write_text('credentials "app.terraform.io" {}\n')
+
+    plugin_cache.setup(mirror=tmp_path / "mirror")
+
+    config_file = plugin_cache.subprocess.environ["TF_CLI_CONFIG_FILE"]
+    config = (tmp_path / "plugins.tfrc").read_text()
+    assert config_file == str(tmp_path / "plugins.tfrc")
+    assert config.startswith('credentials "app.terraform.io" {}\n')
+    assert f'path = "{tmp_path / "mirror"}"' in config
+
+
+def test_setup_mirror_with_provider_installation(plugin_cache, tmp_path, monkeypatch):
+    user_config = tmp_path / "user.tfrc"
+    user_config.write_text("provider_installation {\n  direct {}\n}\n")
+    monkeypatch.setenv("TF_CLI_CONFIG_FILE", str(user_config))
+
+    with pytest.raises(PluginCache.ConfigError):
+        plugin_cache.setup(mirror=tmp_path / "mirror")
@@ -0,0 +1,378 @@
+import asyncio
+import os
+import subprocess
+
+import pytest
+
+from zz.services.terraform import Terraform
+from zz.services.terraform import index_terraform_directory
+
+
+LOCK_ERROR = """\
+╷
+│ Error: Error acquiring the state lock
+│
+│ Error message: ConditionalCheckFailedException: The conditional request
+│ failed
+│ Lock Info:
+│   ID:        2c1b2c4a-5bd2-3a7f-0c24-8f1a6b0f5e3d
+│   Path:      my-bucket/apps/t3can/terraform.tfstate
+│   Operation: OperationTypeApply
+│   Who:       ci@runner-42
+│   Version:   1.5.7
+│   Created:   2025-03-04 12:59:40.762 +0000 UTC
+│   Info:
+│
+│ Terraform acquires a state lock to protect the state from being written
+│ by multiple users at the same time. Please resolve the issue above and try
+│ again. For most commands, you can disable locking with the "-lock=false"
+│ flag, but this is not recommended.
+╵
+"""
+
+
+def _colored(output):
+    """
+    Formats the given diagnostic like terraform does without -no-color.
+    """
+    result = []
+    for i_line in output.splitlines():
+        border, text = i_line[:1], i_line[2:]
+        result.append(f"\x1b[31m{border}\x1b[0m \x1b[0m{text}\x1b[0m")
+    return "\n".join(result)
+
+
+@pytest.mark.parametrize("output", [LOCK_ERROR, _colored(LOCK_ERROR)])
+def test_locked_error(output):
+    e = Terraform.LockedError(output)
+    assert e.lock_id == "2c1b2c4a-5bd2-3a7f-0c24-8f1a6b0f5e3d"
+    assert e.holder == "ci@runner-42 (OperationTypeApply)"
+    assert e.lock_info["Created"] == "2025-03-04 12:59:40.762 +0000 UTC"
+    assert str(e) == "Locked: 2c1b2c4a-5bd2-3a7f-0c24-8f1a6b0f5e3d"
+
+
+def test_locked_error_without_lock_info():
+    e = Terraform.LockedError("Error: Error acquiring the state lock")
+    assert e.lock_id == "unknown"
+    assert e.holder == "? (?)"
+
+
+FAKE_TERRAFORM = """\
+#!/bin/sh
+echo "$@" >> ../terraform.log
+if [ "$1" = init ]; then
+  mkdir -p .terraform && touch .terraform/terraform.tfstate
+elif [ "$1" = show ]; then
+  echo '{"resource_changes": []}'
+fi
+"""
+
+
+@pytest.fixture
+def fake_terraform(tmp_path, monkeypatch):
+    """
+    A workdir (app) with a fake terraform executable logging its arguments to terraform.log.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "terraform").write_text(FAKE_TERRAFORM)
+    (bin_dir / "terraform").chmod(0o755)
+    (tmp_path / "app").mkdir()
+    (tmp_path / "app/main.tf").write_text('resource "null_resource" "a" {\n}\n')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("TF_PLUGIN_CACHE_DIR", str(tmp_path / "plugins"))
+    return tmp_path / "terraform.log"
+
+
+def test_apply_with_init(tmp_path, fake_terraform):
+    result = asyncio.run(Terraform().apply(["app:dev"]))
+
+    assert [i.errors for i in result] == [[]]
+    assert fake_terraform.read_text().splitlines() == [
+        "init -no-color",
+        "workspace select dev",
+        "apply --auto-approve",
+    ]
+
+
+def test_incremental_plan_after_other_plan(fake_terraform):
+    def _plan(**kwargs):
+        result = asyncio.run(Terraform().generate_reports(["app:dev"], **kwargs))
+        assert [i.errors for i in result] == [[]]
+        log = fake_terraform.read_text() if fake_terraform.is_file() else ""
+        fake_terraform.unlink(missing_ok=True)
+        plans = [i for i in log.splitlines() if i.startswith("plan")]
+        return plans, result[0].reused_at is not None
+
+    assert _plan(incremental=True) == (["plan -out .terraform/dev.tfplan"], False)
+    assert _plan(incremental=True) == ([], True)
+    # A plan without refresh replaces the reusable full plan.
+    assert _plan(plan_options=Terraform.PlanOptions(refresh=False)) == (
+        ["plan -out .terraform/dev.tfplan -refresh=false"],
+        False,
+    )
+    assert _plan(incremental=True) == (["plan -out .terraform/dev.tfplan"], False)
+
+
+def test_isolated_data_dir(tmp_path):
+    plugin = tmp_path / "plugins/registry.terraform.io/hashicorp/null/3.2.2/linux_amd64"
+    plugin.mkdir(parents=True)
+    (plugin / "terraform-provider-null").write_text("binary")
+    source = tmp_path / "app/.terraform"
+    providers = source / "providers/registry.terraform.io/hashicorp/null/3.2.2"
+    providers.mkdir(parents=True)
+    (providers / "linux_amd64").symlink_to(
+        os.path.relpath(plugin, providers), target_is_directory=True
+    )
+    (source / "modules/vpc").mkdir(parents=True)
+    (source / "modules/vpc/main.tf").write_text("")
+    (source / "terraform.tfstate").write_text("{}")
+
+    result = Terraform._isolated_data_dir(tmp_path / "app", "dev")
+
+    assert result == source / "zz/dev"
+    provider = result / "providers/registry.terraform.io/hashicorp/null/3.2.2"
+    assert (provider / "linux_amd64/terraform-provider-null").read_text() == "binary"
+    assert (result / "modules/vpc/main.tf").is_file()
+    assert (result / "terraform.tfstate").read_text() == "{}"
+
+
+def _initialized_workdir(tmp_path):
+    workdir = tmp_path / "app"
+    (workdir / "network").mkdir(parents=True)
+    (workdir / "main.tf").write_text(
+        'terraform {\n  backend "s3" {\n    key = "app"\n  }\n}\n\n'
+        'module "network" {\n  source = "./network"\n}\n\n'
+        'resource "aws_instance" "app" {\n  ami = "ami-1"\n}\n'
+    )
+    (workdir / "network/main.tf.json").write_text(
+        '{"resource": {"aws_vpc": {"main": {"cidr_block": "10.0.0.0/16"}}}}'
+    )
+    (workdir / ".terraform/modules").mkdir(parents=True)
+    (workdir / ".terraform/modules/modules.json").write_text(
+        '{"Modules": [{"Key": "", "Dir": "."}, {"Key": "network", "Dir": "network"}]}'
+    )
+    (workdir / ".terraform/terraform.tfstate").write_text("{}")
+    plugin = tmp_path / "plugins/registry.terraform.io/hashicorp/aws/5.31.0/linux_amd64"
+    plugin.mkdir(parents=True)
+    providers = (
+        workdir / ".terraform/providers/registry.terraform.io/hashicorp/aws/5.31.0"
+    )
+    providers.mkdir(parents=True)
+    (providers / "linux_amd64").symlink_to(plugin, target_is_directory=True)
+    return workdir
+
+
+def test_init_fingerprint(tmp_path):
+    workdir = _initialized_workdir(tmp_path)
+    fingerprint = Terraform._init_fingerprint(workdir)
+    assert fingerprint is not None
+
+    # Changes not affecting init.
+    main_tf = workdir / "main.tf"
+    main_tf.write_text(main_tf.read_text().replace("ami-1", "ami-2"))
+    assert Terraform._init_fingerprint(workdir) == fingerprint
+
+    # New implicit provider.
+    main_tf.write_text(main_tf.read_text() + 'resource "random_id" "suffix" {\n}\n')
+    assert Terraform._init_fingerprint(workdir) != fingerprint
+    fingerprint = Terraform._init_fingerprint(workdir)
+
+    # Changes on *.tf.json files.
+    (workdir / "network/main.tf.json").write_text(
+        '{"module": {"subnets": {"source": "./subnets"}}}'
+    )
+    assert Terraform._init_fingerprint(workdir) != fingerprint
+
+
+def test_init_fingerprint_missing_init_files(tmp_path):
+    workdir = _initialized_workdir(tmp_path)
+    fingerprint = Terraform._init_fingerprint(workdir)
+
+    # Provider removed from the plugin cache (broken link).
+    plugin = tmp_path / "plugins/registry.terraform.io/hashicorp/aws/5.31.0/linux_amd64"
+    plugin.rename(plugin.with_name("darwin_arm64"))
+    assert Terraform._init_fingerprint(workdir) != fingerprint
+    plugin.with_name("darwin_arm64").rename(plugin)
+    assert Terraform._init_fingerprint(workdir) == fingerprint
+
+    # Local module removed.
+    (workdir / "network/main.tf.json").unlink()
+    (workdir / "network").rmdir()
+    assert Terraform._init_fingerprint(workdir) is None
+
+    # Not initialized.
+    (workdir / ".terraform/terraform.tfstate").unlink()
+    assert Terraform._init_fingerprint(workdir) is None
+
+
+MAIN_TF = """\
+resource "aws_instance" "app" {
+  ami = "ami-1"
+  user_data = <<-EOF
+    #!/bin/sh
+resource "fake" "in_heredoc" {
+}
+    EOF
+  tags = {
+    Name = "app-{}"  # resource "fake" "in_comment" {
+  }
+}
+
+  resource "aws_eip" "indented" {
+    instance = aws_instance.app.id
+  }
+
+/*
+resource "fake" "in_block_comment" {
+}
+*/
+module "network" {
+  source = "./network"
+}
+data "aws_ami" "base" {
+}
+"""
+
+NETWORK_TF_JSON = """\
+{
+  "resource": {"aws_vpc": {"main": {"cidr_block": "10.0.0.0/16"}}},
+  "module": [{"subnets": {"source": "./subnets"}}]
+}
+"""
+
+
+def test_index_terraform_directory(tmp_path):
+    (tmp_path / "main.tf").write_text(MAIN_TF)
+    (tmp_path / "network.tf.json").write_text(NETWORK_TF_JSON)
+
+    resources, modules = index_terraform_directory(str(tmp_path))
+
+    assert resources == {
+        "aws_instance.app": str(tmp_path / "main.tf"),
+        "aws_eip.indented": str(tmp_path / "main.tf"),
+        "aws_vpc.main": str(tmp_path / "network.tf.json"),
+    }
+    assert modules == {
+        "network": str(tmp_path / "main.tf"),
+        "subnets": str(tmp_path / "network.tf.json"),
+    }
+
+
+PLAN_TARGETS_DIFF = """\
+diff --git app/main.tf app/main.tf
+index 1111111..2222222 100644
+--- app/main.tf
++++ app/main.tf
+@@ -1 +1 @@
+-resource "aws_instance" "old_name" {
++resource "aws_instance" "new_name" {
+@@ -10,0 +11,2 @@
++resource "aws_eip" "added" {
++}
+diff --git app/network.tf app/network.tf
+deleted file mode 100644
+index 3333333..0000000
+--- app/network.tf
++++ /dev/null
+@@ -1,3 +0,0 @@
+-module "network" {
+-  source = "./network"
+-}
+diff --git app/network/main.tf app/network/main.tf
+index 4444444..5555555 100644
+--- app/network/main.tf
++++ app/network/main.tf
+@@ -1,2 +0,0 @@
+-resource "aws_vpc" "main" {
+-}
+diff --git app/templates/user_data.sh app/templates/user_data.sh
+new file mode 100644
+index 0000000..6666666
+--- /dev/null
++++ app/templates/user_data.sh
+@@ -0,0 +1 @@
++#!/bin/sh
+"""
+
+
+def test_parse_diff(tmp_path):
+    filenames, removed = Terraform._parse_diff(
+        PLAN_TARGETS_DIFF, tmp_path, tmp_path / "app"
+    )
+
+    assert filenames == {
+        tmp_path / "app/main.tf",
+        tmp_path / "app/network.tf",
+        tmp_path / "app/network/main.tf",
+        tmp_path / "app/templates/user_data.sh",
+    }
+    # Only blocks removed from the root module: the module's resources are covered by the
+    # module call.
+    assert removed == {"aws_instance.old_name", "module.network"}
+
+
+@pytest.fixture
+def git_workdir(tmp_path, monkeypatch):
+    """
+    A git repository with a committed workdir (app) using a local module (app/network).
+    """
+    workdir = tmp_path / "app"
+    (workdir / "network").mkdir(parents=True)
+    (workdir / "tfvars").mkdir()
+    (workdir / "templates").mkdir()
+    (workdir / "main.tf").write_text(
+        'resource "aws_instance" "app" {\n}\n\n'
+        'module "network" {\n  source = "./network"\n}\n'
+    )
+    (workdir / "network/main.tf").write_text('resource "aws_vpc" "main" {\n}\n')
+    (workdir / "tfvars/dev.tfvars").write_text("")
+    (workdir / "tfvars/prod.tfvars").write_text("")
+    (workdir / "templates/user_data.sh").write_text("#!/bin/sh\n")
+    (tmp_path / ".gitignore").write_text(".terraform/\n")
+    (workdir / ".terraform/modules").mkdir(parents=True)
+    (workdir / ".terraform/modules/modules.json").write_text(
+        '{"Modules": [{"Key": "", "Dir": "."}, {"Key": "network", "Dir": "network"}]}'
+    )
+    monkeypatch.setenv("HOME", str(tmp_path))
+    for i_cmd_line in (
+        ["git", "init", "-q"],
+        ["git", "add", "."],
+        ["git", "-c", "user.name=zz", "-c", "user.email=zz@zz", "commit", "-qm", "."],
+    ):
+        subprocess.run(i_cmd_line, cwd=tmp_path, check=True)
+    return workdir
+
+
+NEW_RESOURCE = 'resource "aws_instance" "app2" {\n}\n'
+
+
+@pytest.mark.parametrize(
+    "changes, expected",
+    [
+        (
+            {"main.tf": NEW_RESOURCE},
+            ["aws_instance.app", "aws_instance.app2", "module.network"],
+        ),
+        ({"network/main.tf": 'resource "aws_subnet" "a" {\n}\n'}, ["module.network"]),
+        # Other deployments tfvars do not affect the plan.
+        ({"network/main.tf": "\n", "tfvars/prod.tfvars": "a = 1"}, ["module.network"]),
+        # Changes on other files require a full plan.
+        ({"main.tf": NEW_RESOURCE, "tfvars/dev.tfvars": "a = 1"}, None),
+        ({"main.tf": NEW_RESOURCE, "templates/user_data.sh": "#!/bin/bash\n"}, None),
+        ({"main.tf": NEW_RESOURCE, "network/policy.json": "{}"}, None),
+        ({"tfvars/prod.tfvars": "a = 1"}, None),
+    ],
+)
+def test_plan_targets(git_workdir, changes, expected):
+    for i_name, i_contents in changes.items():
+        filename = git_workdir / i_name
+        if filename.suffix == ".tf":
+            i_contents = filename.read_text() + i_contents
+        filename.write_text(i_contents)
+
+    result = asyncio.run(Terraform()._plan_targets(git_workdir, "dev", "HEAD"))
+
+    assert result == expected
@@ -1,3 +1,7 @@
+import json
+import os
+import pathlib
+
 from zerotk import deps
 
 
@@ -5,10 +9,15 @@ from zerotk import deps
 class Caches:
     """
     Cache service.
+
+    * get/set: In memory cache (process lifetime);
+    * get_persistent/set_persistent: On disk cache (JSON serializable values only).
     """
 
     _caches = {}
 
+    PERSISTENT_DIR = "~/.cache/zz"
+
     def get(self, cache_name: str, *args) -> str:
         cache_key = tuple(args)
         cache_data = self._caches.setdefault(cache_name, {})
@@ -19,3 +28,28 @@ class Caches:
         cache_data = self._caches.setdefault(cache_name, {})
         cache_data[cache_key] = value
         return cache_key
+
+    def get_persistent(self, cache_name: str, cache_key: str) -> any:
+        """
+        Returns the value stored on disk for the given key or None if not found.
+        """
+        filename = self._persistent_filename(cache_name, cache_key)
+        try:
+            with open(filename, "r") as iss:
+                return json.load(iss)
+        except (OSError, ValueError):
+            return None
+
+    def set_persistent(self, cache_name: str, cache_key: str, value: any) -> str:
+        filename = self._persistent_filename(cache_name, cache_key)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        # Write and rename so concurrent readers never see a partial file.
+        temp_filename = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        with open(temp_filename, "w") as oss:
+            json.dump(value, oss)
+        os.replace(temp_filename, filename)
+        return cache_key
+
+    def _persistent_filename(self, cache_name: str, cache_key: str) -> pathlib.Path:
+        directory = pathlib.Path(self.PERSISTENT_DIR).expanduser()
+        return directory / cache_name / cache_key[:2] / f"{cache_key}.json"
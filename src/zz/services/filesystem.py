@@ -44,3 +44,76 @@ class FileSystem:
         from addict import Dict as AttrDict
 
         return json.loads(contents, object_hook=AttrDict)
+
+    def iter_json_array(
+        cls, filename: Path, key: str, chunk_size: int = 1024**2
+    ) -> Iterable:
+        """
+        Iterates over the items of the array associated with the given key, reading the file
+        in chunks so only one item is kept in memory at a time.
+
+        Items are expected to be objects. The key is searched as the first `"<key>":` occurrence
+        in the file, which is only reliable for keys not used elsewhere in the document. Text
+        around the JSON document (eg. log lines) is ignored.
+        """
+        import json
+        import re
+
+        decoder = json.JSONDecoder()
+        separators = re.compile(r"[\s,]*")
+        token = f'"{key}":'
+        buffer = ""
+        # Position of the next item on the buffer: the buffer is only compacted when reading
+        # more data, so each item is parsed without copying the buffer.
+        position = 0
+        eof = False
+
+        with open(filename, "r") as iss:
+
+            def _read():
+                nonlocal buffer, position, eof
+                # Grow geometrically so items larger than chunk_size are not parsed too often.
+                chunk = iss.read(max(chunk_size, len(buffer) - position))
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+
+            # Find the start of the array, keeping only what might be a partial token.
+            while True:
+                _read()
+                index = buffer.find(token)
+                if index != -1:
+                    break
+                if eof:
+                    return
+                position = max(0, len(buffer) - len(token))
+            position = index + len(token)
+
+            # Skip the opening bracket.
+            while True:
+                position = separators.match(buffer, position).end()
+                if position < len(buffer) or eof:
+                    break
+                _read()
+            if not buffer.startswith("[", position):
+                return
+            position += 1
+
+            while True:
+                position = separators.match(buffer, position).end()
+                if position == len(buffer):
+                    if eof:
+                        return
+                    _read()
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    _read()
+                    continue
+                position = end
+                yield item
@@ -48,7 +48,9 @@ class Git:
         async with semaphore:
             self.console.update_block(directory, f"[white]{directory}[/white]: sync")
 
-            r = await self.subprocess.run_async("hub sync", cwd=directory)
+            r = await self.subprocess.run_async(
+                "hub sync", cwd=directory, tail_lines=None
+            )
             status = r.output.split("\n")[0]
             if r.retcode != 0:
                 self.console.update_block(
@@ -58,7 +60,9 @@ class Git:
 
             self.console.update_block(directory, f"[white]{directory}[/white]: status")
 
-            r = await self.subprocess.run_async("git status -b -s", cwd=directory)
+            r = await self.subprocess.run_async(
+                "git status -b -s", cwd=directory, tail_lines=None
+            )
             if r.retcode != 0:
                 self.console.update_block(
                     directory, f"[white]{directory}[/white]: [red]status[/red]"
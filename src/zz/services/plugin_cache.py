@@ -0,0 +1,186 @@
+import asyncio
+import contextlib
+import os
+import re
+import shutil
+import time
+
+from zerotk import deps
+
+from .filesystem import FileSystem
+from .subprocess import SubProcess
+
+
+@deps.define
+class PluginCache:
+    """
+    Shared terraform provider plugin cache (TF_PLUGIN_CACHE_DIR) managed by zz.
+
+    * The cache directory is set for every subprocess started by zz;
+    * Terraform does not support concurrent writes to the cache, so inits that need to download
+      providers run one at a time (in this and other zz processes) while inits that find all
+      their providers in the cache run concurrently;
+    * A file lock (shared for cache hits, exclusive for downloads and prune) serializes the
+      writes to the cache across zz processes;
+    * Optionally, providers are installed from a local filesystem mirror (offline installation).
+    """
+
+    class ConfigError(RuntimeError):
+        pass
+
+    filesystem = deps.Singleton(FileSystem)
+    subprocess = deps.Singleton(SubProcess)
+
+    directory: FileSystem.Path = deps.field(default=None)
+    _download_lock: asyncio.Lock = deps.field(default=None)
+
+    DEFAULT_DIRECTORY = "~/.cache/zz/terraform/plugins"
+
+    PROVIDER_INSTALLATION_RE = re.compile(r"^\s*provider_installation\b", re.MULTILINE)
+
+    # Matches the provider blocks on .terraform.lock.hcl:
+    #   provider "registry.terraform.io/hashicorp/aws" {
+    #     version = "5.31.0"
+    LOCKFILE_PROVIDER_RE = re.compile(
+        r'^provider\s+"(?P<source>[^"]+)"\s*\{\s*version\s*=\s*"(?P<version>[^"]+)"',
+        re.MULTILINE,
+    )
+
+    def setup(self, mirror: FileSystem.Path = None) -> FileSystem.Path:
+        """
+        Creates the cache directory and configures the environment of all subprocesses to use it.
+
+        :param mirror: A local filesystem mirror (terraform providers mirror) to install
+            providers from, falling back to the registry for providers not found there. The
+            user's CLI configuration (TF_CLI_CONFIG_FILE or ~/.terraformrc) is kept, adding the
+            mirror to it.
+        """
+        directory = os.environ.get("TF_PLUGIN_CACHE_DIR", self.DEFAULT_DIRECTORY)
+        self.directory = self.filesystem.Path(directory).expanduser().absolute()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.subprocess.environ["TF_PLUGIN_CACHE_DIR"] = str(self.directory)
+
+        if mirror is not None:
+            mirror = self.filesystem.Path(mirror).expanduser().absolute()
+            user_config = self.filesystem.Path(
+                os.environ.get("TF_CLI_CONFIG_FILE", "~/.terraformrc")
+            ).expanduser()
+            user_config = user_config.read_text() if user_config.is_file() else ""
+            if self.PROVIDER_INSTALLATION_RE.search(user_config):
+                raise self.ConfigError(
+                    "The terraform CLI configuration already defines provider_installation,"
+                    " add the filesystem mirror there instead of using a plugin mirror."
+                )
+            config_file = self._sibling(".tfrc")
+            config_file.write_text(
+                f"""{user_config}
+
+provider_installation {{
+  filesystem_mirror {{
+    path = "{mirror}"
+  }}
+  direct {{}}
+}}
+"""
+            )
+            self.subprocess.environ["TF_CLI_CONFIG_FILE"] = str(config_file)
+        return self.directory
+
+    def providers(self, workdir: FileSystem.Path) -> list[tuple[str, str]]:
+        """
+        Returns the providers (source, version) locked by the given workdir's lockfile.
+        """
+        lockfile = workdir / ".terraform.lock.hcl"
+        if not lockfile.is_file():
+            return []
+        return self.LOCKFILE_PROVIDER_RE.findall(lockfile.read_text())
+
+    def lookup(self, workdir: FileSystem.Path) -> tuple[list, list]:
+        """
+        Returns the (hits, misses) of the given workdir's providers in the cache.
+
+        Touches the providers found in the cache, marking them as recently used (see prune).
+        """
+        hits, misses = [], []
+        for i_source, i_version in self.providers(workdir):
+            version_dir = self.directory / i_source / i_version
+            if version_dir.is_dir() and any(version_dir.iterdir()):
+                os.utime(version_dir)
+                hits.append(f"{i_source} {i_version}")
+            else:
+                misses.append(f"{i_source} {i_version}")
+        return hits, misses
+
+    @contextlib.asynccontextmanager
+    async def init_lock(self, workdir: FileSystem.Path):
+        """
+        Context for running terraform init on the given workdir. Yields the (hits, misses) of the
+        workdir's providers in the cache.
+
+        Without a lockfile the providers are unknown: the init is handled as a cache miss.
+        """
+        if self.directory is None:
+            self.setup()
+        if self._download_lock is None:
+            self._download_lock = asyncio.Lock()
+
+        hits, misses = self.lookup(workdir)
+        with open(self._sibling(".lock"), "a") as lock_file:
+            if misses or not hits:
+                async with self._download_lock:
+                    await self._flock(lock_file, exclusive=True)
+                    yield hits, misses
+            else:
+                await self._flock(lock_file, exclusive=False)
+                yield hits, misses
+
+    def prune(self, max_age: int) -> list[FileSystem.Path]:
+        """
+        Removes the provider versions not used (see lookup) in the last max_age days.
+
+        Returns the removed directories.
+        """
+        import fcntl
+
+        if self.directory is None:
+            self.setup()
+        result = []
+        threshold = time.time() - max_age * 24 * 60 * 60
+        with open(self._sibling(".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # <hostname>/<namespace>/<type>/<version>
+            for i_version_dir in sorted(self.directory.glob("*/*/*/*")):
+                if i_version_dir.is_dir() and i_version_dir.stat().st_mtime < threshold:
+                    shutil.rmtree(i_version_dir)
+                    result.append(i_version_dir)
+            for i_dir in sorted(self.directory.glob("**/"), reverse=True):
+                if i_dir != self.directory and not any(i_dir.iterdir()):
+                    i_dir.rmdir()
+        return result
+
+    def summary(self) -> tuple[int, int]:
+        """
+        Returns the number of provider versions in the cache and their total size (bytes).
+        """
+        if self.directory is None:
+            self.setup()
+        count = len([i for i in self.directory.glob("*/*/*/*") if i.is_dir()])
+        size = sum(
+            i.stat().st_size
+            for i in self.directory.rglob("*")
+            if i.is_file() and not i.is_symlink()
+        )
+        return count, size
+
+    def _sibling(self, suffix: str) -> FileSystem.Path:
+        """
+        Files managed by zz are kept beside the cache directory since terraform handles every
+        directory inside the cache as a provider hostname.
+        """
+        return self.directory.with_name(self.directory.name + suffix)
+
+    async def _flock(self, lock_file, exclusive: bool) -> None:
+        import fcntl
+
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        await asyncio.to_thread(fcntl.flock, lock_file, operation)
@@ -1,4 +1,6 @@
+import functools
 import pathlib
+import typing
 
 from zerotk import deps
 
@@ -11,17 +13,46 @@ class SubProcess:
 
     execution_logs = []
 
+    # Extra environment variables for all executions.
+    environ = {}
+
     class Result:
 
-        def __init__(self, cmd_line, retcode, output, error):
+        def __init__(
+            self,
+            cmd_line,
+            retcode,
+            output,
+            error,
+            start=None,
+            end=None,
+            cpu_time=None,
+            max_rss=None,
+            log_filename=None,
+        ):
             self.cmd_line = cmd_line
             self.retcode = retcode
             self.output = output
             self.error = error
+            # Execution times (seconds since the epoch).
+            self.start = start
+            self.end = end
+            # User + system CPU time (seconds) and peak resident set size (bytes) of the
+            # command, including its (waited for) child processes.
+            self.cpu_time = cpu_time
+            self.max_rss = max_rss
+            # Complete output of the command (output and error may keep only the last lines).
+            self.log_filename = log_filename
 
         def is_error(self):
             return self.retcode != 0
 
+        @property
+        def duration(self):
+            if self.start is None or self.end is None:
+                return None
+            return self.end - self.start
+
     def call(self, *args, **kwargs) -> int:
         import subprocess
 
@@ -38,23 +69,174 @@ class SubProcess:
             stdout=subprocess.PIPE,
         )
 
+    # Maximum number of commands executed concurrently by run_async.
+    MAX_WORKERS = 64
+
+    # Number of (last) lines of each output stream kept in memory by run_async.
+    TAIL_LINES = 200
+
+    # The complete output of every command executed by run_async is written to a log file in a
+    # directory per zz execution. Only the last LOGS_KEEP directories are kept.
+    LOGS_DIR = "~/.cache/zz/logs"
+    LOGS_KEEP = 10
+
+    _executor = None
+    _logs_directory = None
+    _logs_count = 0
+
     async def run_async(
-        self, cmd_line: str, cwd: pathlib.Path = None
-    ) -> tuple[int, str]:
+        self,
+        cmd_line: str,
+        cwd: pathlib.Path = None,
+        env: dict = None,
+        output_filename: pathlib.Path = None,
+        tail_lines: int = TAIL_LINES,
+        on_line: typing.Callable[[str, str], None] = None,
+    ) -> Result:
+        """
+        Runs the given command line.
+
+        The output is read as it is produced and written to the command's log file
+        (Result.log_filename), keeping only the last lines of output and error in memory.
+        The command is waited for in a worker thread (see _run) to collect its resource usage,
+        which asyncio subprocesses do not provide.
+
+        :param env: Extra environment variables (added to the current environment).
+        :param output_filename: Writes the standard output directly to this file instead of
+            the log file (Result.output is empty).
+        :param tail_lines: Number of lines of each stream kept on Result.output and
+            Result.error. With None, the complete output is kept.
+        :param on_line: Called (in the event loop) with the stream name ("output" or
+            "error") and the contents of each line, as soon as the line is produced.
+        """
         import asyncio
+        import concurrent.futures
+        import os
+
+        env = {**os.environ, **self.environ, **(env or {})}
 
-        proc = await asyncio.create_subprocess_shell(
+        if SubProcess._executor is None:
+            SubProcess._executor = concurrent.futures.ThreadPoolExecutor(
+                self.MAX_WORKERS, thread_name_prefix="zz-subprocess"
+            )
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            SubProcess._executor,
+            self._run,
             cmd_line,
-            stderr=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            cwd=str(cwd),
+            cwd,
+            env,
+            output_filename,
+            self._log_filename(cmd_line),
+            tail_lines,
+            on_line and functools.partial(loop.call_soon_threadsafe, on_line),
         )
-        (stdout, stderr) = await proc.communicate()
-        result = self.Result(
+        self.execution_logs.append(result)
+        return result
+
+    def _run(
+        self,
+        cmd_line: str,
+        cwd: pathlib.Path,
+        env: dict,
+        output_filename: pathlib.Path,
+        log_filename: pathlib.Path,
+        tail_lines: int,
+        on_line: typing.Callable[[str, str], None],
+    ) -> Result:
+        """
+        Runs the given command line, blocking until it finishes.
+
+        Both pipes are read line by line (one of them in an extra thread), so the command never
+        blocks writing to a full pipe. The process is reaped with os.wait4, returning its CPU
+        time and peak memory usage.
+        """
+        import collections
+        import contextlib
+        import os
+        import subprocess
+        import sys
+        import threading
+        import time
+
+        log_lock = threading.Lock()
+        tails = dict(
+            output=collections.deque(maxlen=tail_lines),
+            error=collections.deque(maxlen=tail_lines),
+        )
+
+        def _read(stream, pipe):
+            for i_line in iter(pipe.readline, b""):
+                with log_lock:
+                    log_file.write(i_line)
+                line = i_line.decode("UTF-8", errors="replace")
+                tails[stream].append(line)
+                if on_line is not None:
+                    on_line(stream, line.rstrip("\n"))
+
+        with contextlib.ExitStack() as stack:
+            log_file = stack.enter_context(open(log_filename, "wb"))
+            log_file.write(f"$ {cmd_line}\n".encode("UTF-8"))
+            if output_filename is None:
+                stdout_target = subprocess.PIPE
+            else:
+                stdout_target = stack.enter_context(open(output_filename, "wb"))
+            start = time.time()
+            with subprocess.Popen(
+                cmd_line,
+                shell=True,
+                stdout=stdout_target,
+                stderr=subprocess.PIPE,
+                cwd=None if cwd is None else str(cwd),
+                env=env,
+            ) as proc:
+                error_reader = threading.Thread(
+                    target=_read, args=("error", proc.stderr)
+                )
+                error_reader.start()
+                if proc.stdout is not None:
+                    _read("output", proc.stdout)
+                error_reader.join()
+                _pid, status, rusage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+            end = time.time()
+
+        # ru_maxrss is measured in kilobytes on Linux and in bytes on macOS.
+        max_rss = rusage.ru_maxrss
+        if sys.platform != "darwin":
+            max_rss *= 1024
+        return self.Result(
             cmd_line=cmd_line,
             retcode=proc.returncode,
-            output=stdout.decode("UTF-8"),
-            error=stderr.decode("UTF-8"),
+            output="".join(tails["output"]),
+            error="".join(tails["error"]),
+            start=start,
+            end=end,
+            cpu_time=rusage.ru_utime + rusage.ru_stime,
+            max_rss=max_rss,
+            log_filename=log_filename,
         )
-        self.execution_logs.append(result)
-        return result
+
+    def _log_filename(self, cmd_line: str) -> pathlib.Path:
+        """
+        Returns a new log filename for the given command line, creating the logs directory of
+        this execution (and removing the oldest ones) on the first call.
+        """
+        import datetime
+        import os
+        import re
+        import shutil
+
+        if SubProcess._logs_directory is None:
+            logs_dir = pathlib.Path(self.LOGS_DIR).expanduser()
+            directory = (
+                logs_dir / f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+            )
+            directory.mkdir(parents=True, exist_ok=True)
+            for i_directory in sorted(logs_dir.iterdir())[: -self.LOGS_KEEP]:
+                shutil.rmtree(i_directory, ignore_errors=True)
+            SubProcess._logs_directory = directory
+
+        SubProcess._logs_count += 1
+        name = re.sub(r"[^\w.-]+", "-", cmd_line).strip("-")[:60]
+        return SubProcess._logs_directory / f"{SubProcess._logs_count:04d}-{name}.log"
@@ -1,6 +1,18 @@
 import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import graphlib
+import hashlib
+import json
+import os
 import pathlib
+import random
 import re
+import shlex
+import shutil
+import time
+import typing
 
 import addict
 
@@ -9,8 +21,108 @@ from zerotk import deps
 from .caches import Caches
 from .console import Console
 from .filesystem import FileSystem
+from .plugin_cache import PluginCache
 from .subprocess import SubProcess
-from .text import Text
+
+
+# Resource and module block headers. Eg.:
+#   resource "aws_instance" "app" {
+#   module "network" {
+TERRAFORM_BLOCK_RE = re.compile(
+    r'^[ \t]*(resource|module)[ \t]+"?([\w.-]+)"?(?:[ \t]+"?([\w.-]+)"?)?[ \t]*\{',
+    re.MULTILINE,
+)
+
+# Tokens changing the nesting of HCL: strings, comments, heredoc starts and braces.
+HCL_TOKEN_RE = re.compile(
+    r'"(?:[^"\\\n]|\\.)*"|#|//|/\*|<<-?"?(?P<heredoc>\w+)"?[ \t]*$|[{}]'
+)
+
+
+def _scan_hcl_line(line: str, depth: int, comment: bool) -> tuple[int, bool, str]:
+    """
+    Returns the (depth, comment, heredoc) state after the given HCL line: the braces nesting
+    depth, whether a block comment is open and the marker of the heredoc started by the line.
+    """
+    position = 0
+    while True:
+        if comment:
+            position = line.find("*/", position)
+            if position == -1:
+                return depth, comment, None
+            comment = False
+            position += 2
+        match = HCL_TOKEN_RE.search(line, position)
+        token = None if match is None else match.group()
+        if token is None or token in ("#", "//"):
+            return depth, comment, None
+        if token.startswith("<<"):
+            return depth, comment, match.group("heredoc")
+        position = match.end()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth = max(depth - 1, 0)
+        elif token == "/*":
+            comment = True
+
+
+def iter_terraform_blocks(text: str):
+    """
+    Yields the (kind, label, name) of the top level resource and module blocks (see
+    TERRAFORM_BLOCK_RE) of the given HCL text, skipping nested blocks, comments and heredocs.
+    """
+    depth = 0
+    heredoc = None
+    comment = False
+    for i_line in text.splitlines():
+        if heredoc is not None:
+            if i_line.strip() == heredoc:
+                heredoc = None
+            continue
+        if depth == 0 and not comment:
+            match = TERRAFORM_BLOCK_RE.match(i_line)
+            if match is not None:
+                yield match.groups()
+        depth, comment, heredoc = _scan_hcl_line(i_line, depth, comment)
+
+
+def index_terraform_directory(directory: str) -> tuple[dict, dict]:
+    """
+    Return the maps from resource address (type.name) and module call name to the filename
+    declaring them in the given terraform module directory (*.tf and *.tf.json files).
+
+    This is a module level function so it can be executed in a process pool.
+    """
+    directory = pathlib.Path(directory)
+    resources_map = {}
+    modules_map = {}
+
+    for i_filename in sorted(directory.glob("*.tf")):
+        filename = str(i_filename)
+        for j_kind, j_label, j_name in iter_terraform_blocks(i_filename.read_text()):
+            if j_kind == "resource" and j_name:
+                resources_map.setdefault(f"{j_label}.{j_name}", filename)
+            elif j_kind == "module":
+                modules_map.setdefault(j_label, filename)
+
+    for i_filename in sorted(directory.glob("*.tf.json")):
+        filename = str(i_filename)
+        contents = json.loads(i_filename.read_text())
+
+        def _blocks(key):
+            blocks = contents.get(key, {})
+            return blocks if isinstance(blocks, list) else [blocks]
+
+        for j_block in _blocks("resource"):
+            for k_type, k_resources in j_block.items():
+                for l_name in k_resources:
+                    resources_map.setdefault(f"{k_type}.{l_name}", filename)
+        for j_block in _blocks("module"):
+            for k_name in j_block:
+                modules_map.setdefault(k_name, filename)
+
+    return resources_map, modules_map
 
 
 @deps.define
@@ -20,43 +132,100 @@ class TerraformConfig:
     """
 
     caches = deps.Singleton(Caches)
+    console = deps.Singleton(Console)
     filesystem = deps.Singleton(FileSystem)
-    subprocess = deps.Singleton(SubProcess)
-    text = deps.Singleton(Text)
 
     workdir: FileSystem.Path = deps.field(default=".")
 
-    async def _modules(self, workdir, module):
-        cache_key, result = self.caches.get("TerraforConfig._modules", workdir, module)
+    INSPECT_CACHE = "terraform/config-index"
+    INSPECT_STAT_CACHE = "terraform/config-inspect-stat"
 
-        if result is None:
-            result = {}
+    # Number of processes used to index module directories. With 0 (the default) directories
+    # are indexed in the current process, which is usually fast enough.
+    INDEX_PROCESSES = 0
+
+    # Maximum number of concurrent directory inspections.
+    INSPECT_JOBS = 8
+
+    def _module_dirs(self, workdir) -> dict:
+        """
+        Returns a map from module key to module directory, as listed on the workdir's modules
+        manifest (.terraform/modules/modules.json).
+        """
+        cache_key, result = self.caches.get("TerraformConfig._module_dirs", workdir)
 
+        if result is None:
             modules_filename = workdir / ".terraform/modules/modules.json"
             raw_modules = self.filesystem.read_json(modules_filename)
-            raw = {}
-            for i_module in raw_modules.Modules:
-                try:
-                    raw[i_module.Key] = await self._terraform_config_inspect(
-                        workdir / i_module.Dir
-                    )
-                except Exception as e:
-                    raise RuntimeError(
-                        f"While loading terraform configuration for module: {modules_filename}"
-                    ) from e
-            result = raw.get(module, (None, None))
-            self.caches.set("TerraforConfig._modules", cache_key, result)
+            result = {i.Key: workdir / i.Dir for i in raw_modules.Modules}
+            self.caches.set("TerraformConfig._module_dirs", cache_key, result)
+
+        return result
+
+    async def _modules(self, workdir, module):
+        """
+        Returns the (resources, modules) maps of the given module key, inspecting only the
+        module's directory.
+        """
+        directory = self._module_dirs(workdir).get(module)
+        if directory is None:
+            return None, None
+        try:
+            result = await self._shared_inspection(directory)
+        except Exception as e:
+            raise RuntimeError(
+                f"While loading terraform configuration for module: {directory}"
+            ) from e
+        return result or (None, None)
+
+    def _shared_inspection(self, directory) -> asyncio.Future:
+        """
+        Returns the (single) in-flight inspection of the given directory, so concurrent
+        deployments never inspect the same directory twice. The number of concurrent
+        inspections is limited to INSPECT_JOBS.
+        """
+        directory = self.filesystem.Path(directory).resolve()
+        # Futures and semaphores are bound to the event loop.
+        loop = asyncio.get_running_loop()
+        semaphore_key, semaphore = self.caches.get(
+            "TerraformConfig._inspect_semaphore", loop
+        )
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.INSPECT_JOBS)
+            self.caches.set(
+                "TerraformConfig._inspect_semaphore", semaphore_key, semaphore
+            )
+
+        cache_key, result = self.caches.get(
+            "TerraformConfig._inspections", loop, directory
+        )
+        if result is None:
 
+            async def _inspect():
+                async with semaphore:
+                    return await self._inspect_directory(directory)
+
+            result = asyncio.ensure_future(_inspect())
+            self.caches.set("TerraformConfig._inspections", cache_key, result)
         return result
 
     async def _resources_map(self, workdir, root_filename=None, module="", prefix=""):
         cache_key, result = self.caches.get(
-            "TerraformConfig._resources_map", root_filename, module, prefix
+            "TerraformConfig._resources_map", workdir, root_filename, module, prefix
         )
 
         if result is None:
             result = {}
 
+            if module == "":
+                # Index all module directories of the workdir at once.
+                await asyncio.gather(
+                    *[
+                        self._shared_inspection(i)
+                        for i in self._module_dirs(workdir).values()
+                    ]
+                )
+
             resources, modules = await self._modules(workdir, module)
 
             if resources is None:
@@ -65,84 +234,216 @@ class TerraformConfig:
             for i_resource, i_filename in resources.items():
                 result[f"{prefix}{i_resource}"] = root_filename or i_filename
 
-            for i_module in modules:
-                if module == "":
-                    full_module = i_module
-                else:
-                    full_module = f"{module}.{i_module}"
-                r = await self._resources_map(
-                    workdir,
-                    root_filename or modules[i_module],
-                    full_module,
-                    f"{prefix}module.{i_module}.",
-                )
-                result.update(r)
+            # Inspect the module calls concurrently.
+            submodules = await asyncio.gather(
+                *[
+                    self._resources_map(
+                        workdir,
+                        root_filename or modules[i_module],
+                        i_module if module == "" else f"{module}.{i_module}",
+                        f"{prefix}module.{i_module}.",
+                    )
+                    for i_module in modules
+                ]
+            )
+            for i_submodule in submodules:
+                result.update(i_submodule)
 
             self.caches.set("TerraformConfig._resources_map", cache_key, result)
 
         return result
 
-    async def _get_filename(self, workdir, addr: str) -> str:
+    class AddressResolver:
         """
-        Return the filename associated with the given addr.
+        Resolves resource addresses (as found in plans) to the filename declaring them.
+
+        Built once per workdir from _resources_map: each resolution is a dict lookup after
+        removing the instance keys from the address (eg. module.a["x"].aws_instance.b[0] =>
+        module.a.aws_instance.b).
         """
-        import re
 
-        # Remove everything between brackets
-        addr = re.sub(r"\[.*?\]", "", addr)
-        result = await self._resources_map(workdir)
-        return self.filesystem.Path(result.get(addr, "?"))
+        INSTANCE_KEY_RE = re.compile(r"\[.*?\]")
+
+        def __init__(self, workdir: pathlib.Path, resources_map: dict):
+            workdir = workdir.absolute()
+            paths = {}
+            for i_filename in set(resources_map.values()):
+                path = pathlib.Path(i_filename)
+                try:
+                    path = path.relative_to(workdir)
+                except ValueError:
+                    pass  # Ignore if the path is not relative.
+                paths[i_filename] = path
+            self._filenames = {i: paths[j] for i, j in resources_map.items()}
+            self._unknown = pathlib.Path("?")
+
+        def resolve(self, address: str) -> pathlib.Path:
+            if "[" in address:
+                address = self.INSTANCE_KEY_RE.sub("", address)
+            return self._filenames.get(address, self._unknown)
+
+    async def resolver(self, workdir) -> AddressResolver:
+        """
+        Returns the (cached) AddressResolver for the given workdir.
+        """
+        cache_key, result = self.caches.get("TerraformConfig.resolver", workdir)
+        if result is None:
+            result = self.AddressResolver(workdir, await self._resources_map(workdir))
+            self.caches.set("TerraformConfig.resolver", cache_key, result)
+        return result
+
+    # Kinds of the top level blocks on a terraform file, eg. "resource", "locals", "variable".
+    BLOCK_KIND_RE = re.compile(r"^(\w+)[ \t]*[\"{]", re.MULTILINE)
+
+    async def targets(self, workdir, filenames) -> list[str]:
+        """
+        Returns the addresses (for terraform plan -target) covering the changes on the given
+        terraform files (absolute paths) or None if the changes can't be covered by targets.
+
+        * Files of the root module target the resources and module calls declared on them. A
+          file declaring anything else (eg. variables, locals, data sources or providers) or a
+          removed file can affect any resource: returns None;
+        * Files of a local module target all the (top level) calls of the module;
+        * Files of other directories do not affect the workdir and are ignored.
+        """
+        workdir = self.filesystem.Path(workdir)
+        root = workdir.resolve()
+        resources_map = await self._resources_map(workdir)
+
+        # module directory => top level module calls using it
+        module_calls = {}
+        for i_key, i_directory in self._module_dirs(workdir).items():
+            i_directory = i_directory.resolve()
+            if i_key and i_directory != root:
+                module_calls.setdefault(i_directory, set()).add(
+                    f"module.{i_key.split('.')[0]}"
+                )
+
+        # filename => addresses declared on it (resources of module calls are mapped to the
+        # file declaring the call, see _resources_map)
+        addresses = {}
+        for i_address, i_filename in resources_map.items():
+            if i_address.startswith("module."):
+                i_address = ".".join(i_address.split(".")[:2])
+            addresses.setdefault(i_filename, set()).add(i_address)
+
+        result = set()
+        for i_filename in filenames:
+            path = self.filesystem.Path(i_filename)
+            if path.parent in module_calls:
+                result.update(module_calls[path.parent])
+            elif path.parent != root:
+                continue
+            elif not path.is_file():
+                return None
+            elif self._block_kinds(path) - {"resource", "module"}:
+                return None
+            else:
+                result.update(addresses.get(str(path), ()))
+        return sorted(result)
+
+    @classmethod
+    def _block_kinds(cls, filename: pathlib.Path) -> set[str]:
+        if filename.name.endswith(".tf.json"):
+            return set(json.loads(filename.read_text()))
+        return set(cls.BLOCK_KIND_RE.findall(filename.read_text()))
 
-    async def _terraform_config_inspect(self, directory):
+    async def _inspect_directory(self, directory):
         """
-        Return a map between resources names and their filenames in the given project.
+        Return the maps from resources names and module calls to their filenames in the given
+        module directory.
         """
         directory = self.filesystem.Path(directory).resolve()
         cache_key, result = self.caches.get(
-            "TerraformConfig._terraform_config_inspect", directory
+            "TerraformConfig._inspect_directory", directory
         )
 
+        if result is None and not directory.is_dir():
+            self.console.warning(f"Failed to read module directory: {directory}")
+            return None
+
         if result is None:
-            r = await self.subprocess.run_async(
-                f"terraform-config-inspect --json {directory}", cwd=directory
-            )
-            terraform_configuration = self.filesystem.read_json_string(r.output)
+            content_hash = self._directory_hash(directory)
+            result = self._load_inspection(directory, content_hash)
 
-            if r.retcode != 0:
-                diag = terraform_configuration.diagnostics[0]
-                if diag.summary == "Failed to read module directory":
-                    self.console.warning(f"{diag.summary}: {directory}")
-                    return
+            if result is None:
+                executor = self._index_executor()
+                if executor is None:
+                    result = index_terraform_directory(str(directory))
                 else:
-                    raise RuntimeError(
-                        self.text.dedent(
-                            f"""
-                            Call to terreaform-config-inspect failed with message:
-                            {diag.summary}
-                            {diag.detail}
-                            """
-                        )
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        executor, index_terraform_directory, str(directory)
                     )
+                self._store_inspection(directory, content_hash, result)
 
-            resources_map = {}
-            for i_name, i_details in terraform_configuration.managed_resources.items():
-                resources_map[i_name] = i_details.pos.filename
+        self.caches.set("TerraformConfig._inspect_directory", cache_key, result)
+        return result
 
-            modules_map = {}
-            for (
-                i_module_name,
-                i_details,
-            ) in terraform_configuration.module_calls.items():
-                modules_map[i_module_name] = i_details.pos.filename
+    def _index_executor(self):
+        """
+        Returns the (shared) process pool used to index directories or None if disabled.
+        """
+        if not self.INDEX_PROCESSES:
+            return None
+        cache_key, result = self.caches.get("TerraformConfig._index_executor")
+        if result is None:
+            result = concurrent.futures.ProcessPoolExecutor(self.INDEX_PROCESSES)
+            self.caches.set("TerraformConfig._index_executor", cache_key, result)
+        return result
 
-            result = (resources_map, modules_map)
+    def _directory_hash(self, directory: FileSystem.Path) -> str:
+        """
+        Returns a hash of the terraform files (*.tf, *.tf.json) contents of the given directory.
 
-            self.caches.set(
-                "TerraformConfig._terraform_config_inspect", cache_key, result
+        The hash of a directory is stored associated with the files stats (name, size and
+        modification time) so unchanged directories are not read again.
+        """
+        filenames = sorted(
+            [*directory.glob("*.tf"), *directory.glob("*.tf.json")],
+            key=lambda x: x.name,
+        )
+        stats = hashlib.sha256(str(directory).encode())
+        for i_filename in filenames:
+            stat = i_filename.stat()
+            stats.update(
+                f"\0{i_filename.name}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()
             )
+        stats_key = stats.hexdigest()
 
+        result = self.caches.get_persistent(self.INSPECT_STAT_CACHE, stats_key)
+        if result is None:
+            content = hashlib.sha256()
+            for i_filename in filenames:
+                data = i_filename.read_bytes()
+                content.update(f"\0{i_filename.name}\0{len(data)}\0".encode())
+                content.update(data)
+            result = content.hexdigest()
+            self.caches.set_persistent(self.INSPECT_STAT_CACHE, stats_key, result)
         return result
 
+    def _load_inspection(self, directory: FileSystem.Path, content_hash: str):
+        """
+        Loads a directory inspection result from the persistent cache. Filenames are
+        stored relative to the inspected directory since the same module contents may be found
+        in many directories.
+        """
+        cached = self.caches.get_persistent(self.INSPECT_CACHE, content_hash)
+        if cached is None:
+            return None
+        return tuple(
+            {i: str(directory / j) for i, j in i_map.items()} for i_map in cached
+        )
+
+    def _store_inspection(self, directory: FileSystem.Path, content_hash: str, result):
+        def _relative(filename):
+            try:
+                return str(self.filesystem.Path(filename).relative_to(directory))
+            except ValueError:
+                return filename
+
+        cached = [{i: _relative(j) for i, j in i_map.items()} for i_map in result]
+        self.caches.set_persistent(self.INSPECT_CACHE, content_hash, cached)
+
 
 @deps.define
 class Terraform:
@@ -150,9 +451,14 @@ class Terraform:
     filesystem = deps.Singleton(FileSystem)
     console = deps.Singleton(Console)
     subprocess = deps.Singleton(SubProcess)
+    plugin_cache = deps.Singleton(PluginCache)
     config_factory = deps.Factory(TerraformConfig)
 
     _semaphores: list = deps.field(default_factory=list)
+    _configs: dict = deps.field(default_factory=dict)
+    # Trace events (see _timing), only recorded by generate_reports with a trace_filename.
+    _trace_events: list = deps.field(default=None)
+    _trace_start: float = deps.field(default=0.0)
 
     ACTION_MAP = {
         "update": "~",
@@ -164,6 +470,34 @@ class Terraform:
     class ExecutionError(RuntimeError):
         pass
 
+    class LockedError(ExecutionError):
+        """
+        The terraform state is locked by another execution.
+        """
+
+        LOCK_INFO_RE = re.compile(
+            r"^\s*(ID|Path|Operation|Who|Version|Created):\s+(.*)$"
+        )
+
+        # Terraform diagnostics are colored and framed by a border by default. Eg.:
+        #   \x1b[31m│\x1b[0m   ID:        6a3f...
+        ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+        BORDER_CHARS = "│╷╵"
+
+        def __init__(self, error_output: str):
+            self.lock_info = {}
+            for i_line in error_output.splitlines():
+                line = self.ANSI_ESCAPE_RE.sub("", i_line)
+                match = self.LOCK_INFO_RE.match(line.lstrip().lstrip(self.BORDER_CHARS))
+                if match:
+                    self.lock_info.setdefault(match.group(1), match.group(2).strip())
+            self.lock_id = self.lock_info.get("ID", "unknown")
+            super().__init__(f"Locked: {self.lock_id}")
+
+        @property
+        def holder(self) -> str:
+            return f"{self.lock_info.get('Who', '?')} ({self.lock_info.get('Operation', '?')})"
+
     # =============================================================================================== run (sync)
 
     def run(self, cmd, cwd: str, *args) -> None:
@@ -177,35 +511,50 @@ class Terraform:
 
     # =============================================================================================== Apply
 
-    async def apply(self, deployments_seeds, skip_init=False):
+    async def apply(
+        self,
+        deployments_seeds,
+        skip_init=False,
+        force_init=False,
+        jobs=None,
+        dependencies_filename=None,
+        infer_dependencies=False,
+        keep_going=False,
+    ):
+        """
+        Applies the given deployments.
+
+        Deployments are applied concurrently (one at a time per workdir, since they share the
+        workdir's data directory), each one only after all its prerequisites were applied.
+
+        :param jobs: Maximum number of terraform apply executed concurrently. Defaults to the
+            number of CPUs.
+        :param dependencies_filename: YAML file declaring the prerequisites of the deployments
+            (see _load_dependencies).
+        :param infer_dependencies: Also consider the deployments read by terraform_remote_state
+            data sources as prerequisites (see _remote_state_dependencies).
+        :param keep_going: After a failure, skip only the deployments depending on the failed
+            one. By default no other deployment is started (running ones are not interrupted).
+        """
         deployments, workdirs = self._list_deployments(deployments_seeds)
+        jobs = jobs or os.cpu_count() or 1
+        dependencies = self._apply_dependencies(
+            deployments, dependencies_filename, infer_dependencies
+        )
 
-        result = []
-
-        # Initialize each workdir only once
-        self.console.title("Initializing (terraform init)")
-        init_functions = [
-            self._run_init(i_workdir, skip_init=skip_init) for i_workdir in workdirs
-        ]
-        await asyncio.gather(*init_functions)
-        self.console.clear_blocks()
-
-        # First stop. If any of the initialization fails we stop the process.
-        if not self._check_continue():
-            return result
-
-        # Run the report for all deployments
-        self.console.title("Applying...")
-
-        titles = {}
-        for i_workdir, i_deployment, _workspace in deployments:
-            title = i_deployment
-            if not i_deployment.startswith(i_workdir.name):
-                title = f"{i_workdir.name}:{title}"
-            self.console.create_block(title, "...")
-            titles[i_deployment] = title
+        # Each deployment is applied as soon as its own workdir is initialized and its
+        # prerequisites are applied.
+        self.console.title("Applying... (terraform init + apply)")
+        titles = self._create_deployment_blocks(deployments)
+        self._start_init(workdirs, skip_init=skip_init, force_init=force_init)
 
         self._semaphores = {i: asyncio.Semaphore(1) for i in workdirs}
+        self._apply_semaphore = asyncio.Semaphore(jobs)
+        self._apply_halted = False
+        self._applied = {
+            (i_workdir, i_deployment): asyncio.get_running_loop().create_future()
+            for i_workdir, i_deployment, _workspace in deployments
+        }
         functions = [
             self._apply_deployment(
                 i_workdir,
@@ -213,12 +562,15 @@ class Terraform:
                 i_workspace,
                 title=titles[i_deployment],
                 semaphore=self._semaphores[i_workdir],
+                prerequisites=sorted(dependencies[(i_workdir, i_deployment)]),
+                keep_going=keep_going,
             )
             for i_workdir, i_deployment, i_workspace in deployments
         ]
         result = await asyncio.gather(*functions)
+        self.console.clear_blocks()
 
-        # Second and last stop. Check for any errors in the external executions.
+        # Check for any errors in the external executions.
         self._check_continue()
 
         return result
@@ -230,6 +582,8 @@ class Terraform:
         workspace: str,
         title: str,
         semaphore: asyncio.Semaphore = None,
+        prerequisites: list = (),
+        keep_going: bool = False,
     ):
         workspace = workspace or deployment
         result = addict.Dict(
@@ -237,21 +591,191 @@ class Terraform:
             workspace=workspace,
             workdir=workdir,
             changes=[],
+            errors=[],
         )
+        applied = self._applied[(workdir, deployment)]
         try:
+            if not await self._wait_init(workdir, title):
+                result.errors.append(
+                    self.ExecutionError("Skipped: terraform init failed")
+                )
+                return result
+
+            if prerequisites:
+                names = ", ".join(f"{i}:{j}" for i, j in prerequisites)
+                self.console.update_block(title, f"waiting for {names}")
+                failed = [
+                    f"{i}:{j}"
+                    for i, j in prerequisites
+                    if not await self._applied[(i, j)]
+                ]
+                if failed:
+                    names = ", ".join(failed)
+                    self.console.update_block(
+                        title, f"[yellow]skip: {names} failed[/yellow]"
+                    )
+                    result.errors.append(
+                        self.ExecutionError(f"Skipped: {names} failed")
+                    )
+                    return result
+
             self.console.update_block(title, f"waiting for {workdir}")
-            async with semaphore:
+            async with semaphore, self._apply_semaphore:
+                if self._apply_halted:
+                    self.console.update_block(
+                        title, "[yellow]skip: halted after failure[/yellow]"
+                    )
+                    result.errors.append(
+                        self.ExecutionError("Skipped: halted after failure")
+                    )
+                    return result
                 self.console.update_block(title, "apply")
-                await self._run_apply(workdir, deployment, workspace)
+                await self._run_apply(workdir, deployment, workspace, title=title)
+            self.console.update_block(title, "[green]applied[/green]")
         except self.ExecutionError as e:
-            self.console.update_block(
-                title, f"[red]error: (NOT HERE DEBUG)[/red] {e.__class__.__name__}"
-            )
+            self.console.update_block(title, f"[red]error (ExecutionError):[/red] {e}")
+            result.errors.append(e)
         except Exception as e:
             self.console.update_block(
-                title, f"[red]error: (NOT HERE DEBUG)[/red] {e.__class__.__name__}"
+                title, f"[red]error (Exception):[/red] {e.__class__.__name__}"
             )
+            result.errors.append(e)
             raise
+        finally:
+            if result.errors and not keep_going:
+                self._apply_halted = True
+            if not applied.done():
+                applied.set_result(not result.errors)
+        return result
+
+    def _apply_dependencies(
+        self, deployments, dependencies_filename=None, infer_dependencies=False
+    ) -> dict:
+        """
+        Returns the map from each deployment (workdir, deployment) to its prerequisites.
+
+        Only the given deployments are considered: prerequisites not being applied are
+        expected to be already applied. Raises RuntimeError on circular dependencies.
+        """
+        result = {
+            (i_workdir, i_deployment): set()
+            for i_workdir, i_deployment, _ in deployments
+        }
+        sources = []
+        if dependencies_filename is not None:
+            sources.append(self._load_dependencies(dependencies_filename, deployments))
+        if infer_dependencies:
+            sources.append(self._remote_state_dependencies(deployments))
+        for i_source in sources:
+            for j_deployment, j_prerequisites in i_source.items():
+                result[j_deployment].update(j_prerequisites - {j_deployment})
+
+        try:
+            graphlib.TopologicalSorter(result).prepare()
+        except graphlib.CycleError as e:
+            cycle = " -> ".join(f"{i}:{j}" for i, j in e.args[1])
+            raise RuntimeError(f"Circular dependency between deployments: {cycle}")
+        return result
+
+    def _load_dependencies(self, filename, deployments) -> dict:
+        """
+        Loads the prerequisites of the given deployments from a YAML file mapping deployments
+        to the list of deployments they depend on, with the same format of the command line
+        arguments. Eg.:
+
+            apps/t3can:t3can-stage:
+              - shared:shared-stage
+              - network:network-stage
+        """
+        keys = {
+            (i_workdir.resolve(), i_deployment): (i_workdir, i_deployment)
+            for i_workdir, i_deployment, _ in deployments
+        }
+
+        def _key(deployment_seed):
+            workdir, deployment, _workspace = self.split_deployment(deployment_seed)
+            return keys.get((workdir.resolve(), deployment))
+
+        result = {}
+        contents = self.filesystem.read_yaml(pathlib.Path(filename)) or {}
+        for i_seed, i_prerequisites in contents.items():
+            deployment = _key(i_seed)
+            if deployment is None:
+                continue
+            prerequisites = {_key(j) for j in i_prerequisites or []}
+            result.setdefault(deployment, set()).update(prerequisites - {None})
+        return result
+
+    # Backend state key, on backend blocks or *.tfbackend files. Eg.:
+    #   backend "s3" {
+    #     key = "apps/t3can/terraform.tfstate"
+    BACKEND_KEY_RE = re.compile(r'backend\s+"[^"]*"\s*\{[^}]*?\bkey\s*=\s*"([^"]+)"')
+    TFBACKEND_KEY_RE = re.compile(r'^\s*key\s*=\s*"([^"]+)"', re.MULTILINE)
+
+    # Remote state data sources (up to the end of the top level block). Eg.:
+    #   data "terraform_remote_state" "network" {
+    #     backend   = "s3"
+    #     workspace = terraform.workspace
+    #     config = {
+    #       key = "network/terraform.tfstate"
+    REMOTE_STATE_RE = re.compile(
+        r'^data\s+"terraform_remote_state"\s+"[^"]+"\s*\{(.*?)^\}',
+        re.MULTILINE | re.DOTALL,
+    )
+    REMOTE_STATE_KEY_RE = re.compile(r'\bkey\s*=\s*"([^"]+)"')
+    REMOTE_STATE_WORKSPACE_RE = re.compile(
+        r'^\s*workspace\s*=\s*(?:"([^"]+)"|(terraform\.workspace))', re.MULTILINE
+    )
+
+    def _remote_state_dependencies(self, deployments) -> dict:
+        """
+        Infers the prerequisites of the given deployments from their terraform_remote_state
+        data sources: a deployment depends on the deployments whose backend key and workspace
+        match the ones read by the data source.
+
+        Only literal keys and workspaces (or terraform.workspace) are recognized.
+        """
+        backend_keys = {}
+        remote_states = {}
+        for i_workdir in {i for i, _, _ in deployments}:
+            keys = []
+            states = []
+            for j_filename in sorted(i_workdir.glob("*.tf")):
+                contents = j_filename.read_text()
+                keys += self.BACKEND_KEY_RE.findall(contents)
+                for k_block in self.REMOTE_STATE_RE.findall(contents):
+                    key = self.REMOTE_STATE_KEY_RE.search(k_block)
+                    if key is None:
+                        continue
+                    workspace = self.REMOTE_STATE_WORKSPACE_RE.search(k_block)
+                    states.append((key.group(1), workspace and workspace.groups()))
+            for j_filename in sorted(i_workdir.glob("*.tfbackend")):
+                keys += self.TFBACKEND_KEY_RE.findall(j_filename.read_text())
+            backend_keys[i_workdir] = keys[0] if keys else None
+            remote_states[i_workdir] = states
+
+        # (backend key, workspace) => deployment
+        states = {
+            (backend_keys[i_workdir], i_workspace or i_deployment): (
+                i_workdir,
+                i_deployment,
+            )
+            for i_workdir, i_deployment, i_workspace in deployments
+            if backend_keys[i_workdir] is not None
+        }
+        result = {}
+        for i_workdir, i_deployment, i_workspace in deployments:
+            prerequisites = result.setdefault((i_workdir, i_deployment), set())
+            for j_key, j_workspace in remote_states[i_workdir]:
+                if j_workspace is None:
+                    workspace = "default"
+                elif j_workspace[1] is not None:
+                    workspace = i_workspace or i_deployment
+                else:
+                    workspace = j_workspace[0]
+                prerequisite = states.get((j_key, workspace))
+                if prerequisite is not None:
+                    prerequisites.add(prerequisite)
         return result
 
     async def _run_apply(
@@ -259,6 +783,7 @@ class Terraform:
         workdir: pathlib.Path,
         deployment: str,
         workspace: str,
+        title: str = None,
     ) -> None:
         var_file = f"tfvars/{deployment}.tfvars"
 
@@ -274,47 +799,124 @@ class Terraform:
             if r.is_error():
                 raise self.ExecutionError(r)
 
-        r = await self.subprocess.run_async(cmd_line, cwd=workdir)
+        r = await self.subprocess.run_async(
+            cmd_line,
+            cwd=workdir,
+            on_line=self._progress(title, "apply", "complete after", "done"),
+        )
         if r.is_error():
             raise self.ExecutionError(r)
 
         return
 
-    # =============================================================================================== Plan (report)
+    # Minimum interval (seconds) between progress updates of a deployment block.
+    PROGRESS_INTERVAL = 0.5
 
-    async def generate_reports(
-        self, deployments_seeds, skip_init=False, skip_plan=False
-    ):
-        deployments, workdirs = self._list_deployments(deployments_seeds)
+    def _progress(self, title: str, phase: str, marker: str, description: str):
+        """
+        Returns a SubProcess.run_async line callback updating the given deployment block with
+        the number of output lines containing the marker (eg. resources refreshed by plan).
+        """
+        if title is None:
+            return None
+        count = 0
+        updated_at = 0
+
+        def _on_line(stream, line):
+            nonlocal count, updated_at
+            if marker not in line:
+                return
+            count += 1
+            now = time.monotonic()
+            if now - updated_at >= self.PROGRESS_INTERVAL:
+                updated_at = now
+                self.console.update_block(title, f"{phase} ({count} {description})")
+
+        return _on_line
 
-        result = []
+    # =============================================================================================== Plan (report)
 
-        # Initialize each workdir only once
-        self.console.title("Initializing (terraform init)")
-        init_functions = [
-            self._run_init(i_workdir, skip_init=skip_init) for i_workdir in workdirs
-        ]
-        await asyncio.gather(*init_functions)
-        self.console.clear_blocks()
+    # Rough memory footprint of a terraform plan (terraform + provider plugins).
+    PLAN_MEMORY = 1024**3
 
-        # First stop. If any of the initialization fails we stop the process.
-        if not self._check_continue():
+    @classmethod
+    def default_plan_jobs(cls) -> int:
+        """
+        Returns the default number of concurrent terraform plan: one per CPU, limited by the
+        available memory (PLAN_MEMORY per plan).
+        """
+        result = os.cpu_count() or 1
+        try:
+            memory = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
             return result
+        return max(1, min(result, memory // cls.PLAN_MEMORY))
 
-        # Run the report for all deployments
-        self.console.title("Generating reports (terraform plan + report generation)")
-
-        titles = {}
-        for i_workdir, i_deployment, _workspace in deployments:
-            title = i_deployment
-            if not i_deployment.startswith(i_workdir.name):
-                title = f"{i_workdir.name}:{title}"
-            self.console.create_block(title, "...")
-            titles[i_deployment] = title
+    async def generate_reports(
+        self,
+        deployments_seeds,
+        skip_init=False,
+        skip_plan=False,
+        force_init=False,
+        jobs=None,
+        plan_jobs=None,
+        isolate=False,
+        incremental=False,
+        max_plan_age=60,
+        lock_timeout=10,
+        plan_options=None,
+        report_filename=None,
+        trace_filename=None,
+    ):
+        """
+        Plans the given deployments and generates their changes reports.
+
+        :param force_init: Initialize the workdirs even if they are up to date (see
+            _init_fingerprint).
+        :param jobs: Maximum number of reports generated concurrently (also the default for
+            plan_jobs). Defaults to the number of CPUs.
+        :param plan_jobs: Maximum number of terraform plan executed concurrently. Defaults to
+            a value based on the number of CPUs and the available memory.
+        :param isolate: Plan deployments of the same workdir concurrently, each one with its own
+            terraform data directory (see _isolated_data_dir). Without it, deployments of the
+            same workdir are planned one at a time since they share the workdir's terraform
+            data directory (.terraform) and selected workspace.
+        :param incremental: Reuse the previous plan of deployments whose inputs did not change
+            (see _plan_fingerprint) if it is not older than max_plan_age minutes. Changes made
+            outside the workdir (eg. remote state) are only noticed after max_plan_age.
+        :param lock_timeout: Deployments with a locked state are planned again (with
+            exponential backoff, letting other deployments run in the meantime) for up to
+            lock_timeout minutes since the start of the batch.
+        :param plan_options: Faster (but partial) plans for large states, see PlanOptions.
+        :param report_filename: Writes a machine readable report (JSON lines) to this file, one
+            line per deployment as soon as it finishes and a summary line at the end (see
+            _write_report_record).
+        :param trace_filename: Writes the timeline of the init, workspace select, plan, show and
+            report phases of each deployment to this file, in the Chrome trace format (see
+            _write_trace).
+        """
+        start = time.monotonic()
+        self._trace_start = start
+        self._trace_events = None if trace_filename is None else []
+        deployments, workdirs = self._list_deployments(deployments_seeds)
+        jobs = jobs or os.cpu_count() or 1
+        plan_jobs = plan_jobs or min(jobs, self.default_plan_jobs())
 
-        self._workdir_semaphores = {i: asyncio.Semaphore(1) for i in workdirs}
-        self._plan_semaphore = asyncio.Semaphore(1)
-        self._report_semaphore = asyncio.Semaphore(1)
+        # Each deployment is planned as soon as its own workdir is initialized.
+        self.console.title(
+            "Generating reports (terraform init + plan + report generation)"
+        )
+        titles = self._create_deployment_blocks(deployments)
+        self._start_init(workdirs, skip_init=skip_init, force_init=force_init)
+
+        workdir_jobs = len(deployments) if isolate else 1
+        self._workdir_semaphores = {
+            i: asyncio.Semaphore(workdir_jobs) for i in workdirs
+        }
+        self._plan_semaphore = asyncio.Semaphore(plan_jobs)
+        self._report_semaphore = asyncio.Semaphore(jobs)
+        self._lock_deadline = time.monotonic() + lock_timeout * 60
+        self._lock_holders = {}
         generate_report_functions = [
             self._generate_report(
                 i_workdir,
@@ -322,15 +924,30 @@ class Terraform:
                 i_workspace,
                 title=titles[i_deployment],
                 skip_plan=skip_plan,
+                isolate=isolate,
+                incremental=incremental,
+                max_plan_age=max_plan_age,
+                plan_options=plan_options or self.PlanOptions(),
                 workdir_semaphore=self._workdir_semaphores[i_workdir],
                 plan_semaphore=self._plan_semaphore,
                 report_semaphore=self._report_semaphore,
             )
             for i_workdir, i_deployment, i_workspace in deployments
         ]
-        result = await asyncio.gather(*generate_report_functions)
+        with contextlib.ExitStack() as stack:
+            self._report_stream = None
+            if report_filename is not None:
+                self._report_stream = stack.enter_context(open(report_filename, "w"))
+            result = await asyncio.gather(*generate_report_functions)
+            self._write_report_summary(result, time.monotonic() - start)
+            self._report_stream = None
+        self.console.clear_blocks()
+
+        if trace_filename is not None:
+            self._write_trace(trace_filename)
+        self._print_lock_holders()
 
-        # Second and last stop. Check for any errors in the external executions.
+        # Check for any errors in the external executions.
         self._check_continue()
 
         return result
@@ -342,6 +959,10 @@ class Terraform:
         workspace: str,
         title: str,
         skip_plan: bool = False,
+        isolate: bool = False,
+        incremental: bool = False,
+        max_plan_age: int = 60,
+        plan_options: "Terraform.PlanOptions" = None,
         workdir_semaphore: asyncio.Semaphore = None,
         plan_semaphore: asyncio.Semaphore = None,
         report_semaphore: asyncio.Semaphore = None,
@@ -353,29 +974,89 @@ class Terraform:
             workdir=workdir,
             changes=[],
             errors=[],
+            reused_at=None,
+            targets=None,
+            timings={},
         )
+        timings = result.timings
         try:
-            self.console.update_block(title, f"waiting for {workdir}")
-            async with workdir_semaphore, plan_semaphore:
-                self.console.update_block(title, "plan")
-                tf_plan = await self._run_plan(
-                    workdir, deployment, workspace, skip_plan
+            initialized = await self._wait_init(workdir, title)
+            if self._init_timings.get(workdir) is not None:
+                timings["init"] = self._init_timings[workdir]
+            if not initialized:
+                result.errors.append(
+                    self.ExecutionError("Skipped: terraform init failed")
+                )
+                return result
+
+            targets = plan_args = None
+            if not skip_plan and plan_options is not None:
+                targets = await self._plan_targets(
+                    workdir, deployment, plan_options.changed_since
                 )
+                plan_args = plan_options.args(targets)
+
+            fingerprint = reused_at = None
+            if incremental and not skip_plan:
+                fingerprint = self._plan_fingerprint(
+                    workdir, deployment, workspace, plan_args
+                )
+                reused_at = self._reusable_plan(
+                    workdir, deployment, fingerprint, max_plan_age
+                )
+
+            if reused_at is not None:
+                resource_changes = await self._run_plan(
+                    workdir,
+                    deployment,
+                    workspace,
+                    skip_plan=True,
+                    timings=timings,
+                    track=title,
+                )
+            else:
+                resource_changes = await self._run_plan_with_lock_retry(
+                    workdir,
+                    deployment,
+                    workspace,
+                    title,
+                    skip_plan=skip_plan,
+                    isolate=isolate,
+                    plan_args=plan_args,
+                    timings=timings,
+                    semaphores=[workdir_semaphore, plan_semaphore],
+                )
+                if fingerprint is not None:
+                    (workdir / self.PLAN_FINGERPRINT.format(deployment)).write_text(
+                        fingerprint
+                    )
 
             async with report_semaphore:
                 self.console.update_block(title, "report")
+                with self._timing(timings, "report", track=title):
+                    changes = await self._generate_changes(workdir, resource_changes)
                 result = addict.Dict(
                     deployment=deployment,
                     workspace=workspace,
                     workdir=workdir,
-                    changes=await self._generate_changes(workdir, tf_plan),
+                    changes=changes,
                     errors=[],
+                    reused_at=reused_at,
+                    targets=targets,
+                    timings=timings,
                 )
             count = len(result["changes"])
+            reused = ""
+            if reused_at is not None:
+                reused = f" [cyan](reused plan from {reused_at:%H:%M})[/cyan]"
+            if targets is not None:
+                reused += f" [cyan](targeted: {len(targets)} address(es))[/cyan]"
             if count == 0:
-                self.console.update_block(title, "[green]no changes[/green]")
+                self.console.update_block(title, f"[green]no changes[/green]{reused}")
             else:
-                self.console.update_block(title, f"[yellow]{count} change(s)[/yellow]")
+                self.console.update_block(
+                    title, f"[yellow]{count} change(s)[/yellow]{reused}"
+                )
         except self.ExecutionError as e:
             self.console.update_block(title, f"[red]error (ExecutionError):[/red] {e}")
             result.errors.append(e)
@@ -384,15 +1065,228 @@ class Terraform:
                 title, f"[red]error (Exception):[/red] {e.__class__.__name__}"
             )
             result.errors.append(e)
+        finally:
+            self._write_report_record(result)
         return result
 
+    # Delays (seconds) between plans of a deployment with a locked state.
+    LOCK_RETRY_DELAY = 10
+    LOCK_RETRY_MAX_DELAY = 120
+
+    async def _run_plan_with_lock_retry(
+        self,
+        workdir: pathlib.Path,
+        deployment: str,
+        workspace: str,
+        title: str,
+        skip_plan: bool,
+        isolate: bool,
+        semaphores: list[asyncio.Semaphore],
+        plan_args: list[str] = None,
+        timings: dict = None,
+    ) -> list:
+        """
+        Runs _run_plan, planning again while the state is locked (see generate_reports
+        lock_timeout).
+
+        The semaphores are released while waiting, so other deployments use the slot.
+        """
+        delay = self.LOCK_RETRY_DELAY
+        while True:
+            self.console.update_block(title, f"waiting for {workdir}")
+            try:
+                async with contextlib.AsyncExitStack() as stack:
+                    for i_semaphore in semaphores:
+                        await stack.enter_async_context(i_semaphore)
+                    self.console.update_block(title, "plan")
+                    return await self._run_plan(
+                        workdir,
+                        deployment,
+                        workspace,
+                        skip_plan,
+                        isolate=isolate,
+                        plan_args=plan_args,
+                        timings=timings,
+                        track=title,
+                    )
+            except self.LockedError as e:
+                holder = self._lock_holders.setdefault(
+                    e.lock_id, addict.Dict(error=e, deployments=set(), retries=0)
+                )
+                holder.deployments.add(title)
+                # Jitter, spreading the deployments waiting for the same lock.
+                wait = random.uniform(delay / 2, delay)
+                if time.monotonic() + wait > self._lock_deadline:
+                    raise
+                holder.retries += 1
+                self.console.update_block(
+                    title,
+                    f"[yellow]locked by {e.holder}[/yellow], retrying in {wait:.0f}s",
+                )
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.LOCK_RETRY_MAX_DELAY)
+
+    def _print_lock_holders(self):
+        """
+        Prints the state locks found while planning: who was holding them and the deployments
+        affected.
+        """
+        if not self._lock_holders:
+            return
+        self.console.title("State locks")
+        for i_lock_id, i_holder in sorted(self._lock_holders.items()):
+            info = i_holder.error.lock_info
+            self.console.item(
+                f"{i_lock_id}: {i_holder.error.holder} since {info.get('Created', '?')}"
+                f" - {i_holder.retries} retry(ies) for {', '.join(sorted(i_holder.deployments))}",
+                indent=1,
+            )
+
+    class PlanOptions(typing.NamedTuple):
+        """
+        Options trading the completeness of terraform plan for speed on large states.
+
+        * refresh: With False, the resources are not refreshed (-refresh=false), so changes
+          made outside terraform are not noticed;
+        * changed_since: Plan only (-target) the resources and modules declared on the files
+          changed since the given git reference (see _plan_targets);
+        * parallelism: Number of concurrent operations of terraform plan (-parallelism).
+        """
+
+        refresh: bool = True
+        changed_since: str = None
+        parallelism: int = None
+
+        def args(self, targets: list[str] = None) -> list[str]:
+            result = []
+            if not self.refresh:
+                result.append("-refresh=false")
+            if self.parallelism:
+                result.append(f"-parallelism={self.parallelism}")
+            result += [f"-target={i}" for i in targets or ()]
+            return result
+
+    async def _plan_targets(
+        self, workdir: pathlib.Path, deployment: str, changed_since: str
+    ) -> list[str]:
+        """
+        Returns the addresses to plan (-target) given the files changed since the given git
+        reference (including uncommitted and untracked files) or None for a full plan.
+
+        A full plan is required if no terraform file changed, if any other file of the workdir
+        or of its local modules changed (tfvars, templates, scripts, lockfile, etc., except
+        the tfvars of other deployments) or if the changes can't be mapped to resources (see
+        TerraformConfig.targets). Resource and module blocks removed from the workdir files
+        are also targeted, planning their destruction (see _parse_diff).
+        """
+        if changed_since is None:
+            return None
+
+        r = await self.subprocess.run_async(
+            "git rev-parse --show-toplevel", cwd=workdir, tail_lines=None
+        )
+        if r.is_error():
+            raise self.ExecutionError(r)
+        toplevel = pathlib.Path(r.output.strip())
+
+        r = await self.subprocess.run_async(
+            f"git diff -U0 --no-color --no-prefix {shlex.quote(changed_since)}",
+            cwd=workdir,
+            tail_lines=None,
+        )
+        if r.is_error():
+            raise self.ExecutionError(r)
+        diff = r.output
+        module_dirs = [
+            (workdir / i).resolve() for i in self._local_module_dirs(workdir)
+        ]
+        r = await self.subprocess.run_async(
+            "git ls-files --others --exclude-standard --full-name -- "
+            + " ".join(shlex.quote(str(i)) for i in module_dirs),
+            cwd=workdir,
+            tail_lines=None,
+        )
+        if r.is_error():
+            raise self.ExecutionError(r)
+
+        root = workdir.resolve()
+        filenames, removed = self._parse_diff(diff, toplevel, root)
+        filenames |= {toplevel / i for i in r.output.splitlines()}
+
+        terraform_files = []
+        for i_filename in filenames:
+            if ".terraform" in i_filename.parts or not any(
+                i_filename.is_relative_to(j) for j in module_dirs
+            ):
+                continue
+            if i_filename.suffix == ".tf" or i_filename.name.endswith(".tf.json"):
+                terraform_files.append(i_filename)
+            elif (
+                i_filename.parent == root / "tfvars" and i_filename.suffix == ".tfvars"
+            ):
+                if i_filename.name == f"{deployment}.tfvars":
+                    return None
+            else:
+                return None
+
+        if not terraform_files:
+            return None
+        result = await self._config(workdir).targets(workdir, terraform_files)
+        if result is None:
+            return None
+        return sorted(set(result) | removed)
+
+    @classmethod
+    def _parse_diff(
+        cls, diff: str, toplevel: pathlib.Path, root: pathlib.Path
+    ) -> tuple[set, set]:
+        """
+        Returns the changed filenames and the addresses of the resource and module blocks
+        removed from the root module files in the given diff (git diff -U0 --no-prefix).
+        """
+        filenames = set()
+        removed = set()
+        filename = header = None
+        for i_line in diff.splitlines():
+            if i_line.startswith("diff "):
+                header = True
+            elif i_line.startswith("@@"):
+                header = False
+            elif header and i_line.startswith(("--- ", "+++ ")):
+                if i_line[4:] != "/dev/null":
+                    filename = toplevel / i_line[4:]
+                    filenames.add(filename)
+            elif i_line.startswith("-") and filename.parent == root:
+                match = TERRAFORM_BLOCK_RE.match(i_line[1:])
+                if match is None:
+                    continue
+                kind, label, name = match.groups()
+                if kind == "module":
+                    removed.add(f"module.{label}")
+                elif name:
+                    removed.add(f"{label}.{name}")
+        return filenames, removed
+
     async def _run_plan(
         self,
         workdir: pathlib.Path,
         deployment: str,
         workspace: str,
         skip_plan: bool = False,
-    ) -> str:
+        isolate: bool = False,
+        plan_args: list[str] = None,
+        timings: dict = None,
+        track: str = None,
+    ) -> list:
+        """
+        Plans the given deployment, returning its resource changes.
+
+        :param timings: Adds the duration of the workspace, plan, show and report phases to
+            this dict.
+        :param track: Trace track of the phases (see _timing).
+        """
+        if timings is None:
+            timings = {}
         bin_plan = "bin/plan"
         tfplan_bin = f".terraform/{deployment}.tfplan"
         tfplan_json = f".terraform/{deployment}.tfplan.json"
@@ -407,65 +1301,304 @@ class Terraform:
             if (workdir / var_file).exists():
                 cmd_line += f" -var-file {var_file}"
             select_workspace = workspace or deployment
+        for i_arg in plan_args or ():
+            cmd_line += f" {shlex.quote(i_arg)}"
 
         if not skip_plan:
-            if select_workspace:
-                r = await self.subprocess.run_async(
-                    f"terraform workspace select {select_workspace}", cwd=workdir
+            # The previous plan is about to be replaced, possibly by a plan with other
+            # arguments: it is only reused again after this plan succeeds (see
+            # _generate_report).
+            (workdir / self.PLAN_FINGERPRINT.format(deployment)).unlink(missing_ok=True)
+
+            env = data_dir = None
+            if isolate:
+                # Copying the providers may take a while: do not block the other deployments.
+                data_dir = await asyncio.to_thread(
+                    self._isolated_data_dir, workdir, deployment
                 )
+                env = dict(TF_DATA_DIR=str(data_dir))
+                if select_workspace:
+                    # Selecting the workspace via environment does not touch the data dir.
+                    env["TF_WORKSPACE"] = select_workspace
+                    select_workspace = False
+
+            try:
+                if select_workspace:
+                    with self._timing(timings, "workspace", track) as trace_args:
+                        r = await self.subprocess.run_async(
+                            f"terraform workspace select {select_workspace}",
+                            cwd=workdir,
+                        )
+                        trace_args.update(self._usage_args(r))
+                    if r.is_error():
+                        raise self.ExecutionError(r)
+
+                with self._timing(timings, "plan", track) as trace_args:
+                    r = await self.subprocess.run_async(
+                        cmd_line,
+                        cwd=workdir,
+                        env=env,
+                        on_line=self._progress(
+                            track, "plan", "Refreshing state...", "refreshed"
+                        ),
+                    )
+                    trace_args.update(self._usage_args(r))
                 if r.is_error():
+                    if "Error acquiring the state lock" in r.error:
+                        # Locks are handled by _generate_report, not an execution failure.
+                        r.retcode = 0
+                        raise self.LockedError(r.error)
                     raise self.ExecutionError(r)
 
-            r = await self.subprocess.run_async(cmd_line, cwd=workdir)
-            if r.is_error():
-                if "Error acquiring the state lock" in r.error:
-                    match = re.search(r"ID:\s+([a-f0-9-]+)", r.error)
-                    lock_id = match.group(1) if match else "unknown"
-                    r.retcode = 0
-                    raise self.ExecutionError(f"Locked: {lock_id}")
-                raise self.ExecutionError(r)
+                # The plan JSON can be huge: stream it to the file instead of keeping it in
+                # memory.
+                with self._timing(timings, "show", track) as trace_args:
+                    r = await self.subprocess.run_async(
+                        f"terraform show -json {tfplan_bin}",
+                        cwd=workdir,
+                        env=env,
+                        output_filename=workdir / tfplan_json,
+                    )
+                    trace_args.update(self._usage_args(r))
+                if r.is_error():
+                    raise self.ExecutionError(r)
+            finally:
+                if data_dir is not None:
+                    await asyncio.to_thread(shutil.rmtree, data_dir, ignore_errors=True)
 
-            r = await self.subprocess.run_async(
-                f"terraform show -json {tfplan_bin}", cwd=workdir
+        try:
+            with self._timing(timings, "report", track):
+                return self._read_resource_changes(workdir / tfplan_json)
+        except Exception as e:
+            raise self.ExecutionError(str(e))
+
+    @contextlib.contextmanager
+    def _timing(self, timings: dict, phase: str, track: str = None):
+        """
+        Adds the duration (seconds) of the context to the given phase on timings.
+
+        When tracing (see generate_reports trace_filename) the context is also recorded as an
+        event of the given track. Yields a dict of extra arguments for the event.
+        """
+        args = {}
+        start = time.monotonic()
+        try:
+            yield args
+        finally:
+            end = time.monotonic()
+            timings[phase] = timings.get(phase, 0) + end - start
+            if self._trace_events is not None and track is not None:
+                self._trace_events.append((str(track), phase, start, end, args))
+
+    @classmethod
+    def _usage_args(cls, result: SubProcess.Result) -> dict:
+        """
+        Returns the resource usage of the given execution as trace event arguments.
+        """
+        return dict(
+            cmd_line=result.cmd_line,
+            retcode=result.retcode,
+            cpu_time=result.cpu_time,
+            max_rss_mib=result.max_rss and round(result.max_rss / 1024**2, 1),
+        )
+
+    def _write_trace(self, filename) -> None:
+        """
+        Writes the recorded trace events in the Chrome trace format (chrome://tracing or
+        https://ui.perfetto.dev), one track (thread) per workdir init and per deployment.
+        """
+        pid = os.getpid()
+        tracks = {}
+        events = [
+            dict(name="process_name", ph="M", pid=pid, args=dict(name="zz tf plan"))
+        ]
+        for i_track, i_phase, i_start, i_end, i_args in self._trace_events:
+            if i_track not in tracks:
+                tracks[i_track] = len(tracks) + 1
+                events.append(
+                    dict(
+                        name="thread_name",
+                        ph="M",
+                        pid=pid,
+                        tid=tracks[i_track],
+                        args=dict(name=i_track),
+                    )
+                )
+            events.append(
+                dict(
+                    name=i_phase,
+                    cat="terraform",
+                    ph="X",
+                    ts=round((i_start - self._trace_start) * 1e6),
+                    dur=round((i_end - i_start) * 1e6),
+                    pid=pid,
+                    tid=tracks[i_track],
+                    args=i_args,
+                )
             )
-            if r.is_error():
-                raise self.ExecutionError(r)
+        with open(filename, "w") as oss:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), oss)
 
-            # Cleanup output to remove eventual error messages.
-            # Eg.:
-            #   2025-03-04T12:59:40.762Z [ERROR] provider: error encountered while scanning stdout: error="read |0: file already closed"
-            try:
-                output = "\n".join(
-                    [i for i in r.output.splitlines() if i.startswith("{")]
+    PLAN_FINGERPRINT = ".terraform/{}.tfplan.sha256"
+
+    def _plan_fingerprint(
+        self,
+        workdir: pathlib.Path,
+        deployment: str,
+        workspace: str,
+        plan_args: list[str] = None,
+    ) -> str:
+        """
+        Returns a hash of the inputs of the given deployment's plan:
+
+        * Deployment and workspace names and the extra plan arguments (see PlanOptions);
+        * Terraform files of the workdir and of the local modules;
+        * tfvars file, .terraform.lock.hcl and bin/plan script.
+        """
+        config = self._config(workdir)
+        result = hashlib.sha256(f"{deployment}\0{workspace}".encode())
+        for i_arg in plan_args or ():
+            result.update(f"\0{i_arg}".encode())
+        for i_dir in self._local_module_dirs(workdir):
+            directory = (workdir / i_dir).resolve()
+            if directory.is_dir():
+                result.update(
+                    f"\0{i_dir}\0{config._directory_hash(directory)}".encode()
                 )
-                (workdir / tfplan_json).write_text(output)
-            except Exception as e:
-                raise self.ExecutionError(str(e))
+        for i_name in (
+            f"tfvars/{deployment}.tfvars",
+            ".terraform.lock.hcl",
+            "bin/plan",
+        ):
+            if (workdir / i_name).is_file():
+                contents = (workdir / i_name).read_bytes()
+                result.update(f"\0{i_name}\0{len(contents)}\0".encode())
+                result.update(contents)
+        return result.hexdigest()
+
+    def _reusable_plan(
+        self,
+        workdir: pathlib.Path,
+        deployment: str,
+        fingerprint: str,
+        max_plan_age: int,
+    ) -> datetime.datetime:
+        """
+        Returns the time of the previous plan of the given deployment if it can be reused
+        (same fingerprint and not older than max_plan_age minutes) or None.
+        """
+        tfplan_json = workdir / f".terraform/{deployment}.tfplan.json"
+        fingerprint_file = workdir / self.PLAN_FINGERPRINT.format(deployment)
+        if not (tfplan_json.is_file() and fingerprint_file.is_file()):
+            return None
+        if fingerprint_file.read_text() != fingerprint:
+            return None
+        planned_at = datetime.datetime.fromtimestamp(tfplan_json.stat().st_mtime)
+        if datetime.datetime.now() - planned_at > datetime.timedelta(
+            minutes=max_plan_age
+        ):
+            return None
+        return planned_at
+
+    class ResourceChange(typing.NamedTuple):
+        address: str
+        actions: tuple
+
+    def _read_resource_changes(self, filename: pathlib.Path) -> list:
+        """
+        Reads the resource changes of a plan JSON (terraform show -json) as compact
+        ResourceChange records, parsing the file incrementally.
+
+        The output may contain log lines around the JSON document that are ignored. Eg.:
+            2025-03-04T12:59:40.762Z [ERROR] provider: error encountered while scanning stdout: error="read |0: file already closed"
+        """
+        return [
+            self.ResourceChange(
+                address=i["address"], actions=tuple(i["change"]["actions"])
+            )
+            for i in self.filesystem.iter_json_array(filename, "resource_changes")
+        ]
+
+    ISOLATED_DATA_DIR = ".terraform/zz"
+
+    @classmethod
+    def _isolated_data_dir(cls, workdir: pathlib.Path, deployment: str) -> pathlib.Path:
+        """
+        Creates a terraform data directory (TF_DATA_DIR) for the given deployment from the
+        workdir's initialized .terraform directory, so deployments of the same workdir can run
+        concurrently without sharing the selected workspace.
+
+        Providers and modules are hardlinked (copied if hardlinks are not supported), sharing
+        the provider plugins with the workdir's data directory. Symlinks (terraform links the
+        providers from the plugin cache with relative paths) are recreated pointing to their
+        absolute targets since the data directory is deeper than the original one. The
+        directory is removed after the plan (see _run_plan).
+        """
 
-        return self.filesystem.read_json(workdir / tfplan_json)
+        def _copy_tree(src, dst):
+            dst.mkdir()
+            for i_entry in os.scandir(src):
+                target = dst / i_entry.name
+                if i_entry.is_symlink():
+                    os.symlink(os.path.realpath(i_entry.path), target)
+                elif i_entry.is_dir():
+                    _copy_tree(i_entry.path, target)
+                else:
+                    try:
+                        os.link(i_entry.path, target)
+                    except OSError:
+                        shutil.copy2(i_entry.path, target)
+
+        source = (workdir / ".terraform").absolute()
+        result = source.parent / cls.ISOLATED_DATA_DIR / deployment
+        shutil.rmtree(result, ignore_errors=True)
+        result.mkdir(parents=True)
+        for i_name in ("providers", "modules"):
+            if (source / i_name).is_dir():
+                _copy_tree(source / i_name, result / i_name)
+        # Backend configuration.
+        if (source / "terraform.tfstate").is_file():
+            shutil.copy2(source / "terraform.tfstate", result / "terraform.tfstate")
+        return result
 
-    async def _generate_changes(self, workdir, tf_plan):
-        config = self.config_factory(workdir=workdir)
+    async def _generate_changes(self, workdir, resource_changes):
         result = {}
-        for i_change in tf_plan.resource_changes:
-            actions = [self.ACTION_MAP.get(i, i) for i in i_change.change.actions]
-            actions = "/".join(actions)
+        resolver = None
+        actions_map = {}
+        for i_change in resource_changes:
+            actions = actions_map.get(i_change.actions)
+            if actions is None:
+                actions = actions_map[i_change.actions] = "/".join(
+                    self.ACTION_MAP.get(i, i) for i in i_change.actions
+                )
             if actions in ("no-op", "read"):
                 continue
-            filename = await config._get_filename(workdir, i_change.address)
-            try:
-                filename = filename.relative_to(workdir.absolute())
-            except ValueError:
-                pass  # Ignore if the path is not relative.
+            if resolver is None:
+                resolver = await self._config(workdir).resolver(workdir)
+            filename = resolver.resolve(i_change.address)
             result.setdefault(filename, []).append(f"{actions} {i_change.address}")
 
         return result
 
+    def _config(self, workdir) -> TerraformConfig:
+        """
+        Returns the TerraformConfig for the given workdir, creating it only once.
+        """
+        result = self._configs.get(workdir)
+        if result is None:
+            result = self._configs[workdir] = self.config_factory(workdir=workdir)
+        return result
+
     def print_report(self, report):
         changes = report["changes"]
         if not changes:
             return
-        self.console.title(report.deployment, indent=1)
+        title = report.deployment
+        if report.reused_at:
+            title += f" (reused plan from {report.reused_at:%Y-%m-%d %H:%M})"
+        if report.targets is not None:
+            title += f" (targeted: {', '.join(report.targets)})"
+        self.console.title(title, indent=1)
         for i_filename, i_changes in sorted(changes.items()):
             self.console.title(i_filename.name, indent=2)
             for j_change in i_changes:
@@ -487,15 +1620,159 @@ class Terraform:
             r_format = "green"
         return r_format, r_comment
 
+    def _report_record(self, report) -> dict:
+        """
+        Returns the given deployment report as a JSON serializable dict:
+
+        * status: "error", "changes" or "no-changes";
+        * counts: Number of changes per action (create, update, delete, replace);
+        * files: Changes ({"action", "address"}) grouped by filename;
+        * timings: Duration (seconds) of each phase: init (of the workdir, shared by its
+          deployments), workspace (select), plan, show and report.
+        """
+        actions_map = {j: i for i, j in self.ACTION_MAP.items()}
+        counts = {}
+        files = {}
+        for i_filename, i_changes in sorted((report.changes or {}).items()):
+            for j_change in i_changes:
+                actions, address = j_change.split(" ", 1)
+                action = (
+                    "replace" if "/" in actions else actions_map.get(actions, actions)
+                )
+                counts[action] = counts.get(action, 0) + 1
+                files.setdefault(str(i_filename), []).append(
+                    dict(action=action, address=address)
+                )
+        if report.errors:
+            status = "error"
+        elif files:
+            status = "changes"
+        else:
+            status = "no-changes"
+        return dict(
+            type="deployment",
+            deployment=report.deployment,
+            workspace=report.workspace,
+            workdir=str(report.workdir),
+            status=status,
+            counts=counts,
+            files=files,
+            timings={i: round(j, 3) for i, j in report.timings.items()},
+            reused_at=report.reused_at.isoformat() if report.reused_at else None,
+            targets=report.targets,
+            errors=[self._error_message(i) for i in report.errors],
+        )
+
+    @classmethod
+    def _error_message(cls, error: Exception) -> str:
+        result = error.args[0] if error.args else None
+        if isinstance(result, SubProcess.Result):
+            lines = [i for i in result.error.splitlines() if i.strip()]
+            message = f"{result.cmd_line} (retcode: {result.retcode})"
+            return f"{message}: {lines[-1]}" if lines else message
+        return str(error) or error.__class__.__name__
+
+    def _write_report_record(self, report) -> None:
+        """
+        Writes the given deployment report to the report file (if any), flushing it so the
+        partial results of long runs can be consumed.
+        """
+        if self._report_stream is None:
+            return
+        self._report_stream.write(json.dumps(self._report_record(report)) + "\n")
+        self._report_stream.flush()
+
+    def _write_report_summary(self, reports, elapsed: float) -> None:
+        if self._report_stream is None:
+            return
+        records = [self._report_record(i) for i in reports]
+        counts = {}
+        for i_record in records:
+            for j_action, j_count in i_record["counts"].items():
+                counts[j_action] = counts.get(j_action, 0) + j_count
+        statuses = [i["status"] for i in records]
+        summary = dict(
+            type="summary",
+            deployments=len(records),
+            changes=statuses.count("changes"),
+            no_changes=statuses.count("no-changes"),
+            errors=statuses.count("error"),
+            counts=counts,
+            elapsed=round(elapsed, 3),
+        )
+        self._report_stream.write(json.dumps(summary) + "\n")
+        self._report_stream.flush()
+
     # =============================================================================================== Init
 
-    async def _run_init(self, workdir: pathlib.Path, skip_init: bool = False) -> bool:
+    def _create_deployment_blocks(self, deployments) -> dict:
+        """
+        Creates one console block per deployment, returning a map from deployment to its title.
+        """
+        result = {}
+        for i_workdir, i_deployment, _workspace in deployments:
+            title = i_deployment
+            if not i_deployment.startswith(i_workdir.name):
+                title = f"{i_workdir.name}:{title}"
+            self.console.create_block(title, "...")
+            result[i_deployment] = title
+        return result
+
+    def _start_init(
+        self, workdirs, skip_init: bool = False, force_init: bool = False
+    ) -> None:
+        """
+        Starts the initialization of each workdir (only once) in the background.
+
+        Deployments wait only for their own workdir (see _wait_init), so a slow init does not
+        delay the deployments of the other workdirs.
+        """
+        self._init_failed = False
+        self._init_timings = {}
+        self._init_tasks = {
+            i: asyncio.ensure_future(
+                self._run_init(i, skip_init=skip_init, force_init=force_init)
+            )
+            for i in workdirs
+        }
+
+    async def _wait_init(self, workdir: pathlib.Path, title: str) -> bool:
+        """
+        Waits for the initialization of the given workdir.
+
+        Returns False (updating the deployment block) if this or any other workdir failed to
+        initialize: in this case the deployment must not continue.
+        """
+        self.console.update_block(title, f"waiting for init: {workdir}")
+        if not await self._init_tasks[workdir]:
+            self._init_failed = True
+            self.console.update_block(title, "[red]skip: init failed[/red]")
+            return False
+        if self._init_failed:
+            self.console.update_block(
+                title, "[yellow]skip: init failed for other workdir[/yellow]"
+            )
+            return False
+        return True
+
+    async def _run_init(
+        self, workdir: pathlib.Path, skip_init: bool = False, force_init: bool = False
+    ) -> bool:
         self.console.create_block(workdir, "init")
 
         if skip_init:
             self.console.update_block(workdir, "init: [yellow]skip[/yellow]")
             return True
 
+        fingerprint_file = workdir / self.INIT_FINGERPRINT
+        if (
+            not force_init
+            and fingerprint_file.is_file()
+            and fingerprint_file.read_text() == self._init_fingerprint(workdir)
+        ):
+            self.console.update_block(workdir, "init: [green]up to date[/green]")
+            return True
+
         bin_init = "bin/init"
 
         if (workdir / bin_init).exists():
@@ -503,14 +1780,124 @@ class Terraform:
         else:
             cmd_line = "terraform init -no-color"
 
-        r = await self.subprocess.run_async(cmd_line, cwd=workdir)
+        self.console.update_block(workdir, "init: waiting for plugin cache")
+        async with self.plugin_cache.init_lock(workdir) as (hits, misses):
+            plugins = f"(plugins: {len(hits)} hit(s), {len(misses)} miss(es))"
+            self.console.update_block(workdir, f"init {plugins}")
+            timings = {}
+            with self._timing(timings, "init", workdir) as trace_args:
+                r = await self.subprocess.run_async(cmd_line, cwd=workdir)
+                trace_args.update(self._usage_args(r))
+            self._init_timings[workdir] = timings["init"]
         if r.is_error():
-            self.console.update_block(workdir, "init: [red]error[/red]")
+            self._init_failed = True
+            self.console.update_block(workdir, f"init: [red]error[/red] {plugins}")
         else:
-            self.console.update_block(workdir, "init: [green]done[/green]")
+            self.console.update_block(workdir, f"init: [green]done[/green] {plugins}")
+            fingerprint = self._init_fingerprint(workdir)
+            if fingerprint is not None:
+                fingerprint_file.write_text(fingerprint)
 
         return not r.is_error()
 
+    INIT_FINGERPRINT = ".terraform/zz-init.sha256"
+
+    # Configuration affecting terraform init: backend blocks and (module/provider) sources.
+    INIT_CONFIG_RE = re.compile(
+        r'backend\s+"[^"]*"\s*\{[^}]*\}|^\s*(?:source|version)\s*=.*$', re.MULTILINE
+    )
+
+    # Providers used by a module, including the implicit ones (not in required_providers):
+    # provider blocks and the provider prefix of resource and data types. Eg.:
+    #   provider "aws" {
+    #   resource "random_id" "suffix" {   => random
+    INIT_PROVIDER_RE = re.compile(
+        r'^(?:provider\s+"([\w-]+)"|(?:resource|data)\s+"([a-zA-Z0-9]+)_)', re.MULTILINE
+    )
+
+    @classmethod
+    def _init_fingerprint(cls, workdir: pathlib.Path) -> str:
+        """
+        Returns a hash of everything terraform init depends on for the given workdir or None if
+        the workdir is not initialized (or the initialization is incomplete):
+
+        * bin/init script, .terraform.lock.hcl and *.tfbackend files;
+        * Backend blocks, module/provider sources and providers used (see INIT_PROVIDER_RE) of
+          the root module and of the local modules (listed in .terraform/modules/modules.json);
+        * The whole *.tf.json files of those modules;
+        * The module manifest itself (.terraform/modules/modules.json);
+        * The installed providers (.terraform/providers), ignoring broken links to the plugin
+          cache.
+        """
+        modules_json = workdir / ".terraform/modules/modules.json"
+        if not (workdir / ".terraform/terraform.tfstate").is_file():
+            return None
+
+        result = hashlib.sha256()
+
+        def _update(name, contents):
+            result.update(f"{name}\0{len(contents)}\0".encode())
+            result.update(contents)
+
+        if modules_json.is_file():
+            _update(modules_json.name, modules_json.read_bytes())
+            for i_module in cls._module_manifest(workdir):
+                if not (workdir / i_module.Dir).is_dir():
+                    return None
+        module_dirs = cls._local_module_dirs(workdir)
+
+        for i_name in ("bin/init", ".terraform.lock.hcl"):
+            if (workdir / i_name).is_file():
+                _update(i_name, (workdir / i_name).read_bytes())
+        for i_filename in sorted(workdir.glob("*.tfbackend")):
+            _update(i_filename.name, i_filename.read_bytes())
+        for i_dir in module_dirs:
+            providers = set()
+            for j_filename in sorted((workdir / i_dir).glob("*.tf")):
+                contents = j_filename.read_text()
+                config = cls.INIT_CONFIG_RE.findall(contents)
+                _update(f"{i_dir}/{j_filename.name}", "\n".join(config).encode())
+                providers.update(
+                    k_block or k_type
+                    for k_block, k_type in cls.INIT_PROVIDER_RE.findall(contents)
+                )
+            _update(f"{i_dir}/providers", "\n".join(sorted(providers)).encode())
+            for j_filename in sorted((workdir / i_dir).glob("*.tf.json")):
+                _update(f"{i_dir}/{j_filename.name}", j_filename.read_bytes())
+
+        # <hostname>/<namespace>/<type>/<version>/<platform>
+        providers_dir = workdir / ".terraform/providers"
+        installed = [
+            i.relative_to(providers_dir).as_posix()
+            for i in sorted(providers_dir.glob("*/*/*/*/*"))
+            if i.exists()
+        ]
+        _update(".terraform/providers", "\n".join(installed).encode())
+
+        return result.hexdigest()
+
+    @classmethod
+    def _module_manifest(cls, workdir: pathlib.Path) -> list:
+        """
+        Returns the modules listed on .terraform/modules/modules.json (empty if missing).
+        """
+        modules_json = workdir / ".terraform/modules/modules.json"
+        if not modules_json.is_file():
+            return []
+        return addict.Dict(json.loads(modules_json.read_text())).Modules or []
+
+    @classmethod
+    def _local_module_dirs(cls, workdir: pathlib.Path) -> list[str]:
+        """
+        Returns the root module and the local modules (not downloaded by terraform init)
+        directories of the given workdir, relative to it.
+        """
+        result = {"."}
+        for i_module in cls._module_manifest(workdir):
+            if pathlib.Path(i_module.Dir).parts[:1] != (".terraform",):
+                result.add(i_module.Dir)
+        return sorted(result)
+
     # =============================================================================================== Deployments
 
     @classmethod
@@ -551,7 +1938,9 @@ class Terraform:
                 continue
             result = False
             self.console.error(
-                f"Execution failed for '{i_result.cmd_line}' (retcode: {i_result.retcode})\n{i_result.error}",
+                f"Execution failed for '{i_result.cmd_line}'"
+                f" (retcode: {i_result.retcode}, log: {i_result.log_filename})\n"
+                f"{i_result.error}",
             )
         return result
 